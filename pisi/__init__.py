@@ -84,6 +84,9 @@ def _cleanup():
     if filesdb.is_initialized():
         filesdb.close()
 
+    pisi.db.packagedb.package_cache.clear()
+    pisi.fetcher.connection_pool.close()
+
     if ctx.build_leftover and os.path.exists(ctx.build_leftover):
         os.unlink(ctx.build_leftover)
 
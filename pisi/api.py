@@ -20,7 +20,9 @@ import pisi.db.installdb
 import pisi.db.historydb
 import pisi.db.componentdb
 import pisi.db.groupdb
+import pisi.db.upgradabledb
 import pisi.index
+import pisi.indexdelta
 import pisi.config
 import pisi.metadata
 import pisi.file
@@ -241,17 +243,7 @@ def list_upgradable():
     """
     Return a list of packages that are upgraded in the repository -> list_of_strings
     """
-    installdb = pisi.db.installdb.InstallDB()
-    is_upgradable = pisi.operations.upgrade.is_upgradable
-
-    upgradable = list(filter(is_upgradable, installdb.list_installed()))
-    # replaced packages can not pass is_upgradable test, so we add them manually
-    upgradable.extend(list_replaces())
-
-    # consider also blacklist filtering
-    upgradable = pisi.blacklist.exclude_from(upgradable, ctx.const.blacklist)
-
-    return upgradable
+    return pisi.db.upgradabledb.UpgradableDB().list_upgradable()
 
 
 def list_repos(only_active=True):
@@ -344,6 +336,18 @@ def check(package, config=False):
     return pisi.operations.check.check_package(package, config)
 
 
+def check_packages(packages, config=False, since=None, quick=False):
+    """
+    Check packages in parallel, yielding (package, results) in the given order as soon as each package is
+    checked. results are the same as returned by check, or None if the package is not installed
+    @param packages: names of the packages to be checked
+    @param config: _only_ check the config files of the packages
+    @param since: timestamp, regular files with their recorded size and unchanged since then are not hashed
+    @param quick: files matching the stat baseline recorded at install time are not hashed
+    """
+    return pisi.operations.check.check_packages(packages, config, since, quick)
+
+
 def search_package(terms, lang=None, repo=None):
     """
     Return a list of packages that contains all the given terms either in its name, summary or
@@ -381,11 +385,12 @@ def search_component(terms, lang=None, repo=None):
     return componentdb.search_component(terms, lang, repo)
 
 
-def search_file(term):
+def search_file(term, mode=None):
     """
     Returns a tuple of package and matched files list that matches the files of the installed
     packages -> list_of_tuples
     @param term: used to search file -> list_of_strings
+    @param mode: None for an exact or substring search, "prefix" or "basename" -> string
 
     >>> files = pisi.api.search_file("kvm-")
 
@@ -396,6 +401,10 @@ def search_file(term):
     filesdb = pisi.db.filesdb.FilesDB()
     if term.startswith("/"):  # FIXME: why? why?
         term = term[1:]
+    if mode == "prefix":
+        return filesdb.search_prefix(term)
+    if mode == "basename":
+        return filesdb.search_basename(term)
     return filesdb.search_file(term)
 
 
@@ -796,8 +805,12 @@ def info_name(package_name, useinstalldb=False):
     return metadata, files, repo
 
 
-def index(dirs=None, output="eopkg-index.xml", skip_signing=False, compression=0):
-    """Accumulate eopkg XML files in a directory, and write an index."""
+def index(
+    dirs=None, output="eopkg-index.xml", skip_signing=False, compression=0, deltas=0
+):
+    """Accumulate eopkg XML files in a directory, and write an index.
+    If deltas is given, index deltas of the last deltas generations are
+    kept next to the index, see pisi.indexdelta."""
     index = pisi.index.Index()
     index.distribution = None
     if not dirs:
@@ -807,10 +820,20 @@ def index(dirs=None, output="eopkg-index.xml", skip_signing=False, compression=0
         ctx.ui.info(_("Building index of eopkg files under %s") % repo_dir)
         index.index(repo_dir)
 
+    previous = None
+    if deltas and os.path.exists(output):
+        previous = pisi.indexdelta.IndexSnapshot(output)
+
     sign = None if skip_signing else pisi.file.File.detached
     index.write(output, sha1sum=True, compress=compression, sign=sign)
     ctx.ui.info(_("Index file written"))
 
+    if deltas:
+        pisi.indexdelta.write_deltas(output, previous, deltas)
+    else:
+        # clients would follow the deltas of older generations
+        pisi.indexdelta.remove_deltas(output)
+
 
 @locked
 def add_repo(name, indexuri, at=None):
@@ -853,39 +876,59 @@ def remove_repo(name):
 @locked
 def update_repos(repos, force=False):
     pisi.db.historydb.HistoryDB().create_history("repoupdate")
-    updated = False
+    deltas = {}
     try:
         for repo in repos:
-            updated |= __update_repo(repo, force)
+            __update_repo(repo, force, deltas)
     finally:
-        if updated:
-            pisi.db.regenerate_caches()
+        __update_caches(deltas)
 
 
 @locked
 def update_repo(repo, force=False):
     pisi.db.historydb.HistoryDB().create_history("repoupdate")
-    updated = __update_repo(repo, force)
-    if updated:
+    deltas = {}
+    __update_repo(repo, force, deltas)
+    __update_caches(deltas)
+
+
+def __update_caches(deltas):
+    if not deltas:
+        return
+
+    if None in list(deltas.values()):
         pisi.db.regenerate_caches()
+    else:
+        pisi.db.patch_caches(deltas)
 
 
-def __update_repo(repo, force=False):
+def __update_repo(repo, force=False, deltas=None):
+    """Update the index of repo. If it has been updated, the applied
+    pisi.indexdelta.IndexDeltas, or None if the whole index has been
+    fetched, are stored in deltas[repo]."""
     ctx.ui.action(_("Updating repository: %s") % repo)
     ctx.ui.notify(pisi.ui.updatingrepo, name=repo)
     repodb = pisi.db.repodb.RepoDB()
     index = pisi.index.Index()
     if repodb.has_repo(repo):
         repouri = repodb.get_repo(repo).indexuri.get_uri()
-        try:
-            index.read_uri_of_repo(repouri, repo)
-        except pisi.file.AlreadyHaveException as e:
+        applied = None if force else pisi.indexdelta.update_repo(repo, repouri)
+        if applied == []:
             ctx.ui.info(_("%s repository information is up-to-date.") % repo)
-            if force:
-                ctx.ui.info(_("Updating database at any rate as requested"))
-                index.read_uri_of_repo(repouri, repo, force=force)
-            else:
-                return False
+            return False
+        elif applied is None:
+            try:
+                index.read_uri_of_repo(repouri, repo)
+            except pisi.file.AlreadyHaveException as e:
+                ctx.ui.info(_("%s repository information is up-to-date.") % repo)
+                if force:
+                    ctx.ui.info(_("Updating database at any rate as requested"))
+                    index.read_uri_of_repo(repouri, repo, force=force)
+                else:
+                    return False
+
+        if deltas is not None:
+            deltas[repo] = applied
 
         pisi.db.historydb.HistoryDB().update_repo(repo, repouri, "update")
         repodb.check_distribution(repo)
@@ -13,7 +13,7 @@ import zipfile
 import lzma
 
 from pisi import translate as _
-from pisi.usr_merge import is_usr_merged_duplicate
+from pisi.usr_merge import UsrMergeContext
 
 # eopkg modules
 import pisi
@@ -29,55 +29,126 @@ class ArchiveHandlerNotInstalled(Exception):
     pass
 
 
+# size of the compressed blocks read from the archive
+LZMA_READ_BLOCK_SIZE = 1024 * 1024
+# largest amount of data decompressed at once
+LZMA_DECOMPRESS_BLOCK_SIZE = 4 * 1024 * 1024
+
+
 # Proxy class inspired from tarfile._BZ2Proxy
 class _LZMAProxy(object):
-    blocksize = 16 * 1024
+    """File object decompressing or compressing an lzma stream on the fly.
 
-    def __init__(self, fileobj, mode):
+    Decompressed data is appended to a buffer and handed out from a read
+    offset; consumed data is only dropped once it makes up most of the
+    buffer, so reads copy every byte once and short seeks backwards are
+    served from the buffer."""
+
+    def __init__(
+        self,
+        fileobj,
+        mode,
+        blocksize=LZMA_READ_BLOCK_SIZE,
+        decompress_blocksize=LZMA_DECOMPRESS_BLOCK_SIZE,
+    ):
         self.fileobj = fileobj
         self.mode = mode
         self.name = getattr(self.fileobj, "name", None)
+        self.blocksize = blocksize
+        self.decompress_blocksize = decompress_blocksize
+        try:
+            self.start = self.fileobj.tell()
+        except (AttributeError, OSError):
+            self.start = None
         self.init()
 
     def init(self):
-        import lzma
-
         self.pos = 0
         if self.mode == "r":
             self.lzmaobj = lzma.LZMADecompressor()
-            # Seeking here can cause problems with Python 2.7
-            # if hasattr(self.fileobj, "seek"):
-            #     self.fileobj.seek(0)
-            self.buf = b""
+            self.buf = bytearray()
+            self.offset = 0  # read offset in buf, at self.pos
+            self.eof = False
         else:
             self.lzmaobj = lzma.LZMACompressor()
 
-    def read(self, size):
-        b = [self.buf]
-        x = len(self.buf)
-        while x < size:
-            raw = self.fileobj.read(self.blocksize)
-            if not raw:
-                break
+    def __decompress(self, size):
+        """Return up to size more bytes of the stream, empty at its end"""
+        while not self.eof:
+            raw = b""
+            if self.lzmaobj.needs_input:
+                raw = self.fileobj.read(self.blocksize)
+                if not raw:
+                    # truncated stream
+                    self.eof = True
+                    break
             try:
-                data = self.lzmaobj.decompress(raw)
+                data = self.lzmaobj.decompress(raw, size)
             except EOFError:
-                break
-            b.append(data)
-            x += len(data)
-        self.buf = b"".join(
-            [b_item if type(b_item) == bytes else b_item.encode() for b_item in b]
-        )
+                data = b""
+            if self.lzmaobj.eof:
+                self.eof = True
+            if data:
+                return data
+        return b""
+
+    def __fill(self, size):
+        # make size bytes available after the read offset, if the stream
+        # is long enough
+        while len(self.buf) - self.offset < size and not self.eof:
+            if self.offset and self.offset >= len(self.buf) // 2:
+                del self.buf[: self.offset]
+                self.offset = 0
+            wanted = size - (len(self.buf) - self.offset)
+            self.buf += self.__decompress(
+                min(max(wanted, self.blocksize), self.decompress_blocksize)
+            )
 
-        buf = self.buf[:size]
-        self.buf = self.buf[size:]
-        self.pos += len(buf)
-        return buf
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while not self.eof:
+                self.__fill(len(self.buf) - self.offset + self.decompress_blocksize)
+            size = len(self.buf) - self.offset
+        else:
+            self.__fill(size)
+
+        end = min(self.offset + size, len(self.buf))
+        data = bytes(memoryview(self.buf)[self.offset : end])
+        self.pos += end - self.offset
+        self.offset = end
+        return data
+
+    def __skip(self, size):
+        available = len(self.buf) - self.offset
+        if size <= available:
+            self.offset += size
+            self.pos += size
+            return
+
+        # drop the buffer and decompress the rest without keeping it
+        self.pos += available
+        size -= available
+        del self.buf[:]
+        self.offset = 0
+        while size > 0:
+            data = self.__decompress(min(size, self.decompress_blocksize))
+            if not data:
+                break
+            self.pos += len(data)
+            size -= len(data)
 
     def seek(self, pos):
         if pos < self.pos:
+            if self.pos - pos <= self.offset:
+                # still buffered
+                self.offset -= self.pos - pos
+                self.pos = pos
+                return
+            # start over from the beginning of the stream
+            if self.start is not None:
+                self.fileobj.seek(self.start)
             self.init()
-        self.read(pos - self.pos)
+        self.__skip(pos - self.pos)
 
     def tell(self):
         return self.pos
@@ -285,8 +356,10 @@ class ArchiveTar(ArchiveBase):
         shutil.rmtree(info.name)
 
     def unpack_dir(self, target_dir, callback=None, files=None):
-        if files is None:
-            files = self._tar_file_list()
+        """Extract the archive to target_dir. files, the paths in the
+        archive, are used to skip usr merged duplicates. Without them the
+        archive is still read once, see _members()."""
+        usr_merge = UsrMergeContext(files or [])
 
         self.tar = self._open_tar()
 
@@ -301,8 +374,8 @@ class ArchiveTar(ArchiveBase):
         uid = os.getuid()
         gid = os.getgid()
 
-        for tarinfo in self.tar:
-            if is_usr_merged_duplicate(files, tarinfo.path):
+        for tarinfo in self._members(usr_merge, files is None):
+            if usr_merge.is_duplicate(tarinfo.path):
                 ctx.ui.debug("Skipping merged file %s" % tarinfo.path)
                 continue
 
@@ -421,6 +494,9 @@ class ArchiveTar(ArchiveBase):
                 # Try to extract again.
                 self.tar.extract(tarinfo)
 
+            if tarinfo.issym():
+                usr_merge.forget(tarinfo.path)
+
             # tarfile.extract does not honor umask. It must be honored
             # explicitly. See --no-same-permissions option of tar(1),
             # which is the deafult behaviour.
@@ -491,14 +567,30 @@ class ArchiveTar(ArchiveBase):
 
         return tarfile.open(self.file_path, rmode, fileobj=self.fileobj)
 
-    def _tar_file_list(self):
-        with self._open_tar() as tar:
-            paths = [tarinfo.path for tarinfo in tar]
+    def _members(self, usr_merge, streaming):
+        """Yield the members of the archive to extract.
+
+        When streaming, the paths in the archive are not known upfront.
+        They are added to usr_merge as the members are read, and members
+        which are usr merged, but whose equivalent under usr has not been
+        read yet, are held back until the end of the archive. Only then is
+        it known whether they are duplicates. Extracting a held back
+        regular file seeks back in the archive."""
+        if not streaming:
+            yield from self.tar
+            return
 
-        if self.fileobj is not None:
-            self.fileobj.seek(0)
+        held = []
+        for tarinfo in self.tar:
+            usr_merge.add(tarinfo.path)
+            if usr_merge.may_become_duplicate(tarinfo.path):
+                held.append(tarinfo)
+            else:
+                yield tarinfo
 
-        return paths
+        if held:
+            ctx.ui.debug("Extracting %d held back usr merged members" % len(held))
+        yield from held
 
 
 class ArchiveTarZ(ArchiveBase):
@@ -530,7 +622,7 @@ class ArchiveTarZ(ArchiveBase):
                 _("Problem occured while uncompressing %s.Z file") % self.file_path
             )
 
-        files = self._tar_file_list()
+        usr_merge = UsrMergeContext(self._tar_file_list())
         self.tar = tarfile.open(self.file_path)
 
         oldwd = None
@@ -545,11 +637,13 @@ class ArchiveTarZ(ArchiveBase):
         gid = os.getgid()
 
         for tarinfo in self.tar:
-            if is_usr_merged_duplicate(files, tarinfo.path):
+            if usr_merge.is_duplicate(tarinfo.path):
                 ctx.ui.debug("Skipping merged file %s" % tarinfo.path)
                 continue
 
             self.tar.extract(tarinfo)
+            if tarinfo.issym():
+                usr_merge.forget(tarinfo.path)
 
             # tarfile.extract does not honor umask. It must be honored
             # explicitly. See --no-same-permissions option of tar(1),
@@ -684,11 +778,11 @@ class ArchiveZip(ArchiveBase):
         unpacks stuff into target_dir and only extracts files
         from archive_root, treating it as the archive root"""
         zip_obj = self.zip_obj
-        files = [info.filename for info in zip_obj.infolist()]
+        usr_merge = UsrMergeContext(info.filename for info in zip_obj.infolist())
 
         for info in zip_obj.infolist():
             if pred(info.filename):  # check if condition holds
-                if is_usr_merged_duplicate(files, info.filename):
+                if usr_merge.is_duplicate(info.filename):
                     ctx.ui.debug("Skipping merged file %s" % info.filename)
                     continue
 
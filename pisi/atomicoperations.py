@@ -4,7 +4,7 @@
 """Atomic package operations such as install/remove/upgrade"""
 
 from pisi import translate as _
-from pisi.usr_merge import is_usr_merged_duplicate
+from pisi.usr_merge import UsrMergeContext
 
 import os
 import shutil
@@ -19,6 +19,7 @@ import pisi.uri
 import pisi.ui
 import pisi.version
 import pisi.operations.delta
+import pisi.operations.check
 import pisi.db
 import base64
 
@@ -67,9 +68,11 @@ class Install(AtomicOperation):
     automatic = False
 
     @staticmethod
-    def from_name(name, ignore_dep=None):
+    def locate(name):
+        """Return the repository package, the URI of the package file to
+        fetch and its SHA1 sum. For upgrades a delta package is used if
+        possible."""
         packagedb = pisi.db.packagedb.PackageDB()
-        # download package and return an installer object
         # find package in repository
         repo = packagedb.which_repo(name)
         if repo:
@@ -113,28 +116,33 @@ class Install(AtomicOperation):
 
             ctx.ui.info(_("Package URI: %s") % pkg_path, verbose=True)
 
-            # Bug 4113
-            cached_file = pisi.package.Package.is_cached(pkg_path)
-            if cached_file and util.sha1_file(cached_file) != pkg_hash:
-                os.unlink(cached_file)
-                cached_file = None
-
-            install_op = Install(pkg_path, ignore_dep)
-
-            # Bug 4113
-            if not cached_file:
-                downloaded_file = install_op.package.filepath
-                if pisi.util.sha1_file(downloaded_file) != pkg_hash:
-                    raise pisi.Error(
-                        _(
-                            "Download Error: Package does not match the repository package."
-                        )
-                    )
-
-            return install_op
+            return pkg, pkg_path, pkg_hash
         else:
             raise Error(_("Package %s not found in any active repository.") % name)
 
+    @staticmethod
+    def from_name(name, ignore_dep=None):
+        # download package and return an installer object
+        pkg, pkg_path, pkg_hash = Install.locate(name)
+
+        # Bug 4113
+        cached_file = pisi.package.Package.is_cached(pkg_path)
+        if cached_file and util.sha1_file(cached_file) != pkg_hash:
+            os.unlink(cached_file)
+            cached_file = None
+
+        install_op = Install(pkg_path, ignore_dep)
+
+        # Bug 4113
+        if not cached_file:
+            downloaded_file = install_op.package.filepath
+            if pisi.util.sha1_file(downloaded_file) != pkg_hash:
+                raise pisi.Error(
+                    _("Download Error: Package does not match the repository package.")
+                )
+
+        return install_op
+
     def __init__(self, package_fname, ignore_dep=None, ignore_file_conflicts=None):
         "initialize from a file name"
         super(Install, self).__init__(ignore_dep)
@@ -154,6 +162,7 @@ class Install(AtomicOperation):
         self.installdb = pisi.db.installdb.InstallDB()
         self.operation = INSTALL
         self.automatic = False
+        self.config_changed = []
 
     def install(self, ask_reinstall=True):
         # Any package should remove the package it replaces before
@@ -233,7 +242,7 @@ class Install(AtomicOperation):
                 ):
                     file_conflicts.append((pkg, existing_file))
         if file_conflicts:
-            upgradable_pkgs = pisi.api.list_upgradable()
+            upgradable = pisi.db.upgradabledb.UpgradableDB()
             file_conflicts_str = ""
             for pkg, existing_file in file_conflicts:
                 paths = [fileinfo.path for fileinfo in self.files.list]
@@ -242,7 +251,7 @@ class Install(AtomicOperation):
                     # FIXME: If the package is in the updates list assume it's been vetted for now...
                     #        What we really want to do is see if the conflicting pkg exists in the
                     #        install order and the conflicting file no longer exists there.
-                    if pkg in upgradable_pkgs:
+                    if upgradable.has_upgrade(pkg):
                         file_conflicts_str += _(
                             "/%s from %s gets replaced by %s package\n"
                         ) % (existing_file, pkg, self.pkginfo.name)
@@ -312,8 +321,18 @@ class Install(AtomicOperation):
 
         config_changed = []
 
+        # config files untouched since the old package was installed need
+        # not be hashed
+        old_baseline = {}
+        if self.reinstall():
+            old_baseline = pisi.operations.check.read_baseline(
+                self.old_path, self.old_files.list
+            )
+
         def check_config_changed(config):
             fpath = pisi.util.join_path(ctx.config.dest_dir(), config.path)
+            if pisi.operations.check.is_unchanged(config, old_baseline):
+                return
             if pisi.util.config_changed(config):
                 config_changed.append(fpath)
                 self.historydb.save_config(self.pkginfo.name, fpath)
@@ -480,6 +499,9 @@ class Install(AtomicOperation):
 
         if config_changed:
             rename_configs()
+        self.config_changed = [
+            os.path.relpath(x, ctx.config.dest_dir()) for x in config_changed
+        ]
 
         if self.reinstall():
             clean_leftovers()
@@ -511,6 +533,14 @@ class Install(AtomicOperation):
         ctx.ui.info(_("Storing %s") % ctx.const.metadata_xml, verbose=True)
         self.package.extract_file_synced(ctx.const.metadata_xml, self.package.pkg_dir())
 
+        # user changed config files have been put back in place, only the
+        # files written from the package are known to match files.xml
+        ctx.ui.info(_("Storing %s") % ctx.const.files_stat, verbose=True)
+        pristine = self.package.extracted_files.difference(self.config_changed)
+        pisi.operations.check.record_baseline(
+            self.package.pkg_dir(), self.files.list, pristine
+        )
+
         for pcomar in self.metadata.package.providesComar:
             fpath = os.path.join(ctx.const.comar_dir, pcomar.script)
             # comar prefix is added to the pkg_dir while extracting comar
@@ -612,13 +642,15 @@ class Remove(AtomicOperation):
 
         self.check_dependencies()
 
+        usr_merge = UsrMergeContext(self.files.list)
         for fileinfo in self.files.list:
-            if is_usr_merged_duplicate(self.files.list, fileinfo.path):
+            if usr_merge.is_duplicate(fileinfo.path):
                 ctx.ui.debug("Not removing usr-merged file: %s" % fileinfo.path)
                 continue
 
             self.remove_file(fileinfo, self.package_name, True)
-
+            # the file may have been a symlink leading to others
+            usr_merge.forget(fileinfo.path)
         self.update_databases()
 
         self.remove_pisi_files()
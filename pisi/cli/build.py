@@ -111,6 +111,16 @@ class Build(command.Command, metaclass=command.autocommand):
             help=_("Use quilt patch management system " "instead of GNU patch"),
         )
 
+        group.add_option(
+            "--strip-jobs",
+            action="store",
+            default=None,
+            help=_(
+                "Number of files stripped at once, 'auto' for one "
+                "per CPU. Overrides strip_jobs in eopkg.conf"
+            ),
+        )
+
         group.add_option(
             "--ignore-sandbox",
             action="store_true",
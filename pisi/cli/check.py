@@ -1,6 +1,7 @@
 # SPDX-FileCopyrightText: 2005-2011 TUBITAK/UEKAE, 2013-2017 Ikey Doherty, Solus Project
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+import datetime
 import optparse
 
 from pisi import translate as _
@@ -25,6 +26,12 @@ file. Check command uses the checksums to verify a package.
 Just give the names of packages.
 
 If no packages are given, checks all installed packages.
+
+Files are hashed by check_workers workers, see eopkg.conf.
+With --since, files which have their recorded size and
+have not been modified since the given time are not hashed.
+With --quick, files whose inode, size, mtime and ctime
+match those recorded at install time are not hashed.
 """
 )
 
@@ -57,10 +64,43 @@ class Check(command.Command, metaclass=command.autocommand):
             help=_("Checks only changed config files of " "the packages"),
         )
 
+        group.add_option(
+            "--since",
+            action="store",
+            default=None,
+            metavar="TIME",
+            help=_(
+                "Only hash files modified since TIME, given as "
+                "YYYY-MM-DD[ HH:MM[:SS]] or seconds since the epoch"
+            ),
+        )
+
+        group.add_option(
+            "--quick",
+            action="store_true",
+            default=False,
+            help=_(
+                "Only hash files whose stat information differs from "
+                "the one recorded at install time"
+            ),
+        )
+
         self.parser.add_option_group(group)
 
+    @staticmethod
+    def parse_since(since):
+        if since is None:
+            return None
+        try:
+            if since.isdigit():
+                return float(since)
+            return datetime.datetime.fromisoformat(since).timestamp()
+        except ValueError:
+            raise pisi.Error(_("Invalid time given to --since: %s") % since)
+
     def run(self):
         self.init(database=True, write=False)
+        since = self.parse_since(ctx.get_option("since"))
 
         component = ctx.get_option("component")
         if component:
@@ -84,9 +124,10 @@ class Check(command.Command, metaclass=command.autocommand):
         # Determine maximum length of messages for proper formatting
         maxpkglen = max([len(_p) for _p in pkgs])
 
-        for pkg in pkgs:
-            if self.installdb.has_package(pkg):
-                check_results = pisi.api.check(pkg, check_config)
+        for pkg, check_results in pisi.api.check_packages(
+            pkgs, check_config, since, ctx.get_option("quick")
+        ):
+            if check_results is not None:
                 ctx.ui.info(
                     "%s    %s" % ((prefix % pkg), " " * (maxpkglen - len(pkg))),
                     noln=True,
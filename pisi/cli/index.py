@@ -59,6 +59,18 @@ class Index(command.Command, metaclass=command.autocommand):
             help=_("Comma-separated compression types " "for index file. Valid options are \"xz\" and \"bz2\". Defaults to \"xz\"."),
         )
 
+        group.add_option(
+            "--deltas",
+            action="store",
+            type="int",
+            default=0,
+            metavar="N",
+            help=_(
+                "Write an index delta against the previous index and keep "
+                "the deltas of the last N index generations."
+            ),
+        )
+
         group.add_option(
             "--skip-signing",
             action="store_true",
@@ -84,4 +96,5 @@ class Index(command.Command, metaclass=command.autocommand):
             ctx.get_option("output"),
             skip_signing=ctx.get_option("skip_signing"),
             compression=compression,
+            deltas=ctx.get_option("deltas"),
         )
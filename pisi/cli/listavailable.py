@@ -1,6 +1,7 @@
 # SPDX-FileCopyrightText: 2005-2011 TUBITAK/UEKAE, 2013-2017 Ikey Doherty, Solus Project
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+import copy
 import optparse
 
 from pisi import translate as _
@@ -96,13 +97,17 @@ all repositories.
 
             package = self.packagedb.get_package(p, repo)
 
+            # package objects are shared with the PackageDB cache, so
+            # decorate a copy of the name instead of the package itself
             if p in installed_list:
-                package.name = util.colorize(package.name, "green")
+                name = util.colorize(package.name, "green")
             else:
-                package.name = util.colorize(package.name, "brightwhite")
+                name = util.colorize(package.name, "brightwhite")
 
             if self.options.long:
+                package = copy.copy(package)
+                package.name = name
                 ctx.ui.info(str(package) + "\n")
             else:
-                package.name += " " * max(0, maxlen - len(p))
-                ctx.ui.info("%s - %s " % (package.name, str(package.summary)))
+                name += " " * max(0, maxlen - len(p))
+                ctx.ui.info("%s - %s " % (name, str(package.summary)))
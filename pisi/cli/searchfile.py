@@ -41,10 +41,27 @@ Finds the installed package which contains the specified file.
             default=False,
             help=_("Show only package name"),
         )
+        group.add_option(
+            "--prefix",
+            action="store_true",
+            default=False,
+            help=_("Find the files whose path starts with the given path"),
+        )
+        group.add_option(
+            "--basename",
+            action="store_true",
+            default=False,
+            help=_("Find the files with the given file name in any directory"),
+        )
         self.parser.add_option_group(group)
 
     def search_file(self, path):
-        found = pisi.api.search_file(path)
+        mode = None
+        if ctx.get_option("prefix"):
+            mode = "prefix"
+        elif ctx.get_option("basename"):
+            mode = "basename"
+        found = pisi.api.search_file(path, mode)
         for pkg, files in found:
             for pkg_file in files:
                 ctx.ui.info(_("Package %s has file /%s") % (pkg, pkg_file))
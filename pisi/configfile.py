@@ -20,12 +20,15 @@
 # destinationdirectory = /
 # autoclean = False
 # bandwidth_limit = 0
+# download_workers = 4
+# check_workers = auto
 #
 # [build]
 # host = i686-pc-linux-gnu
 # generateDebug = False
 # enableSandbox = False
 # jobs = "-j3"
+# strip_jobs = auto
 # CFLAGS= -mtune=generic -march=i686 -O2 -pipe -fomit-frame-pointer -fstack-protector -D_FORTIFY_SOURCE=2
 # CXXFLAGS= -mtune=generic -march=i686 -O2 -pipe -fomit-frame-pointer -fstack-protector -D_FORTIFY_SOURCE=2
 # LDFLAGS= -Wl,-O1 -Wl,-z,relro -Wl,--hash-style=gnu -Wl,--as-needed -Wl,--sort-common
@@ -76,6 +79,8 @@ class GeneralDefaults:
     package_cache = False
     package_cache_limit = 0
     bandwidth_limit = 0
+    download_workers = 4
+    check_workers = "auto"
     retry_attempts = 5
     ignore_safety = False
     ignore_delta = False
@@ -87,6 +92,7 @@ class BuildDefaults:
     build_host = "localhost"
     host = "x86_64-solus-linux"
     jobs = "auto"
+    strip_jobs = "auto"
     generateDebug = False
     enableSandbox = False  # Dropping sandbox support soon
     cflags = "-mtune=generic -march=x86-64 -g2 -O2 -pipe -fPIC -fno-plt -Wformat -Wformat-security -D_FORTIFY_SOURCE=2 -fstack-protector-strong --param=ssp-buffer-size=32 -fasynchronous-unwind-tables -ftree-vectorize -feliminate-unused-debug-types -fno-omit-frame-pointer -mno-omit-leaf-frame-pointer -Wall -Wno-error -Wp,-D_REENTRANT"
@@ -80,6 +80,7 @@ class Constants(metaclass=Singleton):
         self.__c.comar_dir = "comar"
         self.__c.files_xml = "files.xml"
         self.__c.metadata_xml = "metadata.xml"
+        self.__c.files_stat = "files.stat"
         self.__c.install_tar = "install.tar"
         # Legacy cruft on Solus, sol won't support this
         self.__c.mirrors_conf = "/usr/share/defaults/eopkg/mirrors.conf"
@@ -90,6 +91,9 @@ class Constants(metaclass=Singleton):
         self.__c.needs_reboot = "needsreboot"
         self.__c.auto_installed = "autoinstalled"
         self.__c.files_db = "files.db"
+        self.__c.files_index = "files.idx"
+        self.__c.index_deltas_suffix = ".deltas"
+        self.__c.index_generation_suffix = ".generation"
         self.__c.repos = "repos"
         self.__c.devel_package_end = "-devel"
         self.__c.doc_package_end = "-docs?$"
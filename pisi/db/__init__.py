@@ -1,7 +1,15 @@
 # SPDX-FileCopyrightText: 2005-2011 TUBITAK/UEKAE, 2013-2017 Ikey Doherty, Solus Project
 # SPDX-License-Identifier: GPL-2.0-or-later
 
-from pisi.db import componentdb, groupdb, historydb, installdb, packagedb, repodb
+from pisi.db import (
+    componentdb,
+    groupdb,
+    historydb,
+    installdb,
+    packagedb,
+    repodb,
+    upgradabledb,
+)
 
 
 def invalidate_caches():
@@ -34,6 +42,7 @@ def update_caches():
     ]:
         if db.is_initialized():
             db.cache_save()
+    repodb.RepoDB().release_indexes()
 
 
 def regenerate_caches():
@@ -41,3 +50,27 @@ def regenerate_caches():
     # Force cache regeneration
     for db in [packagedb.PackageDB(), componentdb.ComponentDB(), groupdb.GroupDB()]:
         db.cache_regenerate()
+    repodb.RepoDB().release_indexes()
+
+
+def patch_caches(deltas):
+    # Applies index deltas (repo -> list of pisi.indexdelta.IndexDelta) to
+    # the ondisk caches, regenerating the ones which can not be patched
+    deltas = [(repo, d) for repo, repo_deltas in deltas.items() for d in repo_deltas]
+    if not all(d.has_packages_only() for repo, d in deltas):
+        regenerate_caches()
+        return
+
+    # groups only depend on the Component and Group sections
+    for db_class in [packagedb.PackageDB, componentdb.ComponentDB]:
+        db_class().invalidate()
+        # cache_load replaces the singleton instance
+        if db_class().cache_load() and all(
+            db_class().apply_index_delta(repo, d) for repo, d in deltas
+        ):
+            db_class().cache_save()
+        else:
+            db_class().invalidate()
+            db_class().cache_flush()
+            db_class().cache_regenerate()
+    repodb.RepoDB().release_indexes()
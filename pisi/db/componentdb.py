@@ -7,6 +7,7 @@ from pisi import translate as _
 import pisi
 import pisi.db.repodb
 import pisi.db.itembyrepo
+import pisi.db.indexreader as indexreader
 import pisi.component
 import pisi.db.lazydb as lazydb
 from pisi import context as ctx
@@ -25,36 +26,35 @@ class ComponentDB(lazydb.LazyDB):
         repodb = pisi.db.repodb.RepoDB()
 
         for repo in repodb.list_repos():
-            doc = repodb.get_repo_doc(repo)
-            component_nodes[repo] = self.__generate_components(doc)
-            component_packages[repo] = self.__generate_packages(doc)
-            component_sources[repo] = self.__generate_sources(doc)
+            index = repodb.get_repo_index(repo)
+            component_nodes[repo] = index.components
+            component_packages[repo] = index.component_packages
+            component_sources[repo] = index.component_sources
 
         self.cdb = pisi.db.itembyrepo.ItemByRepo(component_nodes)
         self.cpdb = pisi.db.itembyrepo.ItemByRepo(component_packages)
         self.csdb = pisi.db.itembyrepo.ItemByRepo(component_sources)
 
-    def __generate_packages(self, doc):
-        components = {}
-        for pkg in doc.tags("Package"):
-            components.setdefault(pkg.getTagData("PartOf"), []).append(
-                pkg.getTagData("Name")
-            )
-        return components
-
-    def __generate_sources(self, doc):
-        components = {}
-        for spec in doc.tags("SpecFile"):
-            src = spec.getTag("Source")
-            components.setdefault(src.getTagData("PartOf"), []).append(
-                src.getTagData("Name")
-            )
-        return components
-
-    def __generate_components(self, doc):
-        return dict(
-            [(x.getTagData("Name"), x.toString()) for x in doc.tags("Component")]
-        )
+    def apply_index_delta(self, repo, delta):
+        """Patch the component packages of repo with a
+        pisi.indexdelta.IndexDelta. Returns False if that is not possible."""
+        if not self.cpdb.has_repo(repo) or not delta.has_packages_only():
+            return False
+
+        components = self.cpdb.dbobj[repo]
+        replaced = set(delta.removed).union(delta.packages)
+        for component in list(components):
+            packages = [x for x in components[component] if x not in replaced]
+            if packages:
+                components[component] = packages
+            else:
+                del components[component]
+
+        for name, xml in delta.packages.items():
+            pkg = indexreader.parse_node(xml.encode())
+            components.setdefault(pkg.get("PartOf"), []).append(name)
+
+        return True
 
     def has_component(self, name, repo=None):
         return self.cdb.has_item(name, repo)
@@ -2,7 +2,6 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 
 import dbm
-import hashlib
 import os
 import re
 import shelve
@@ -14,6 +13,7 @@ import pisi
 from pisi import context as ctx
 from pisi import util
 from pisi.db import lazydb
+from pisi.db import filesindex
 
 # FIXME:
 # We could traverse through files.xml files of the packages to find the path and
@@ -25,24 +25,54 @@ from pisi.db import lazydb
 FILESDB_PICKLE_PROTOCOL_VERSION = 2
 
 # We suspect that there will be an advantage in versioning this separately
-FILESDB_FORMAT_VERSION = 4
+# Version 5 stores the real paths as keys instead of their md5 sums.
+FILESDB_FORMAT_VERSION = 5
+
+# Keys holding FilesDB meta data instead of paths, paths never contain NUL
+FILESDB_VERSION_KEY = "\0version"
+FILESDB_GENERATION_KEY = "\0generation"
+FILESDB_META_KEYS = (FILESDB_VERSION_KEY, FILESDB_GENERATION_KEY)
 
 class FilesDB(lazydb.LazyDB):
     def init(self, force_rebuild=False):
         self.filesdb = {}
+        self.index = None
+        # path -> package for added files, path -> None for removed ones
+        self.changes = {}
+        # generation of the index the changes apply to
+        self.base_generation = None
         self.__check_filesdb(force_rebuild)
 
     def has_file(self, path):
-        return hashlib.md5(path.encode()).hexdigest() in self.filesdb
+        return path not in FILESDB_META_KEYS and path in self.filesdb
 
     def get_file(self, path):
-        return self.filesdb[hashlib.md5(path.encode()).hexdigest()], path
+        return self.filesdb[path], path
+
+    def __group(self, found):
+        files = {}
+        for pkg, path in found:
+            files.setdefault(pkg, []).append(path)
+        return sorted(files.items())
+
+    def __get_index(self):
+        if self.changes or not isinstance(self.filesdb, shelve.DbfilenameShelf):
+            return None
+        if self.index is None:
+            self.__open_index()
+        if self.index is None or not self.index.is_valid():
+            return None
+        return self.index
 
     def search_file(self, term):
         if self.has_file(term):
             pkg, path = self.get_file(term)
             return [(pkg, [path])]
 
+        index = self.__get_index()
+        if index is not None:
+            return self.__group(index.substring(term))
+
         installdb = pisi.db.installdb.InstallDB()
         found = []
         for pkg in installdb.list_installed():
@@ -56,6 +86,33 @@ class FilesDB(lazydb.LazyDB):
                 found.append((pkg, paths))
         return found
 
+    def search_prefix(self, prefix):
+        """Return the installed paths starting with prefix, grouped by package"""
+        index = self.__get_index()
+        if index is not None:
+            return self.__group(index.prefix(prefix))
+
+        found = [(pkg, path) for pkg, path in self.__list_files() if path.startswith(prefix)]
+        return self.__group(found)
+
+    def search_basename(self, name):
+        """Return the installed paths whose last component is name, grouped by package"""
+        index = self.__get_index()
+        if index is not None:
+            return self.__group(index.basename(name))
+
+        found = [
+            (pkg, path)
+            for pkg, path in self.__list_files()
+            if os.path.basename(path) == name
+        ]
+        return self.__group(found)
+
+    def __list_files(self):
+        for path in self.filesdb.keys():
+            if path not in FILESDB_META_KEYS:
+                yield self.filesdb[path], path
+
     def get_pkgconfig_provider(self, pkgconfigName):
         """get_pkgconfig_provider will try known paths to find the provider
         of a given pkgconfig name"""
@@ -80,23 +137,110 @@ class FilesDB(lazydb.LazyDB):
     def add_files(self, pkg, files):
         self.__check_filesdb()
 
+        if files.list:
+            self.__invalidate_index()
         for f in files.list:
-            self.filesdb[hashlib.md5(f.path.encode()).hexdigest()] = pkg
+            self.filesdb[f.path] = pkg
+            self.changes[f.path] = pkg
 
     def remove_files(self, files):
         for f in files:
-            if hashlib.md5(f.path.encode()).hexdigest() in self.filesdb:
-                del self.filesdb[hashlib.md5(f.path.encode()).hexdigest()]
+            if f.path in self.filesdb:
+                self.__invalidate_index()
+                del self.filesdb[f.path]
+                self.changes[f.path] = None
 
     def destroy(self):
         files_db = os.path.join(ctx.config.info_dir(), ctx.const.files_db)
         if os.path.exists(files_db):
             os.unlink(files_db)
+        self.__close_index()
+        files_index = os.path.join(ctx.config.info_dir(), ctx.const.files_index)
+        if os.path.exists(files_index):
+            os.unlink(files_index)
 
     def close(self):
         if isinstance(self.filesdb, shelve.DbfilenameShelf):
+            if self.changes:
+                self.__update_index()
             self.filesdb.sync()
             self.filesdb.close()
+        self.__close_index()
+
+    def __invalidate_index(self):
+        # the generation is bumped before the first change is written, so
+        # that the index is not used with a shelve an interrupted operation
+        # left half updated. close() writes the index again.
+        if not self.changes:
+            generation = self.filesdb.get(FILESDB_GENERATION_KEY, 0)
+            self.base_generation = generation
+            self.filesdb[FILESDB_GENERATION_KEY] = generation + 1
+            self.__close_index()
+
+    def __close_index(self):
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+
+    def __open_index(self):
+        """Opens the path index and regenerates it if it is stale and we are allowed to"""
+        self.__close_index()
+        files_index = os.path.join(ctx.config.info_dir(), ctx.const.files_index)
+        self.index = filesindex.FilesIndex(files_index)
+
+        generation = self.filesdb.get(FILESDB_GENERATION_KEY, 0)
+        if self.index.is_valid() and self.index.generation == generation:
+            return
+
+        ctx.ui.debug(
+            "FilesDB index %s is stale (generation %s, need %s)."
+            % (files_index, self.index.generation, generation)
+        )
+        self.__close_index()
+        if os.access(ctx.config.info_dir(), os.W_OK) and isinstance(
+            self.filesdb, shelve.DbfilenameShelf
+        ):
+            self.__write_index(self.__list_files())
+
+    def __write_index(self, files):
+        # the generation ties the index to the state of the shelve, so that
+        # an index left behind by an interrupted operation is never used
+        generation = self.filesdb.get(FILESDB_GENERATION_KEY, 0) + 1
+        files_index = os.path.join(ctx.config.info_dir(), ctx.const.files_index)
+
+        self.__close_index()
+        filesindex.write(files_index, ((path, pkg) for pkg, path in files), generation)
+        self.filesdb[FILESDB_GENERATION_KEY] = generation
+        self.filesdb.sync()
+        self.index = filesindex.FilesIndex(files_index)
+
+    def __update_index(self):
+        # searches are mostly run by users who can not write the index, so it
+        # is brought up to date by the transaction which changed the files
+        changes, self.changes = self.changes, {}
+        if not os.access(ctx.config.info_dir(), os.W_OK):
+            return
+
+        files_index = os.path.join(ctx.config.info_dir(), ctx.const.files_index)
+        index = filesindex.FilesIndex(files_index)
+        try:
+            if index.is_valid() and index.generation == self.base_generation:
+                files = dict((path, pkg) for pkg, path in index.items())
+                for path, pkg in changes.items():
+                    if pkg is None:
+                        files.pop(path, None)
+                    else:
+                        files[path] = pkg
+            else:
+                # no usable base index, start over from the shelve
+                files = dict((path, pkg) for pkg, path in self.__list_files())
+        finally:
+            index.close()
+
+        try:
+            self.__write_index((pkg, path) for path, pkg in files.items())
+        except (IOError, OSError) as e:
+            ctx.ui.debug("Could not write FilesDB index: %s" % e)
 
     def __check_filesdb(self, force_rebuild=False):
         """Sets valid self.files_db reference and automatically rebuilds the underlying db if necessary."""
@@ -250,7 +394,7 @@ class FilesDB(lazydb.LazyDB):
             # If the backing shelve exists and is valid, check if it has a version key
             if valid_shelve and file_exists:
                 try:
-                    version = self.filesdb["version"]
+                    version = self.filesdb[FILESDB_VERSION_KEY]
                 except:
                     msg = _("FilesDB %s has no version.") % files_db
                     if can_write:
@@ -316,7 +460,7 @@ class FilesDB(lazydb.LazyDB):
             ctx.ui.error(_("FilesDB rebuild failed!"))
             raise err
 
-        self.filesdb["version"] = FILESDB_FORMAT_VERSION
+        self.filesdb[FILESDB_VERSION_KEY] = FILESDB_FORMAT_VERSION
         # we need a list of installed files per package
         installdb = pisi.db.installdb.InstallDB()
         pkgs = 0
@@ -341,8 +485,11 @@ class FilesDB(lazydb.LazyDB):
         ctx.ui.info(ngettext("\nOne package added in total.", "\n%s packages added in total.", pkgs))
         # ensure that the changes get pushed out to disk
         self.filesdb.sync()
+        ctx.ui.info(_("Writing FilesDB path index..."))
+        self.changes = {}
+        self.__write_index(self.__list_files())
         # This acts as a check that the version has been correctly added and synced to disk
-        ctx.ui.info(_("Done rebuilding FilesDB (version: %s)") % self.filesdb["version"])
+        ctx.ui.info(_("Done rebuilding FilesDB (version: %s)") % self.filesdb[FILESDB_VERSION_KEY])
 
     def __check_filesdb_old(self):
         """Sets valid self.files_db reference and returns whether the underlying db needs to be rebuilt."""
@@ -394,7 +541,7 @@ class FilesDB(lazydb.LazyDB):
         has_version = True
         version = 0
         try:
-            version = self.filesdb["version"]
+            version = self.filesdb[FILESDB_VERSION_KEY]
         except:
             has_version = False
 
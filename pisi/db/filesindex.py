@@ -0,0 +1,225 @@
+# SPDX-FileCopyrightText: 2024 Solus Project
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Sorted, memory mapped path index used by FilesDB for file searches.
+
+The index file is laid out as follows, all integers in native byte order:
+
+    header      magic, format version, generation, package count,
+                path count and size of the package name table
+    packages    newline separated package names, padded to 8 bytes
+    offsets     (path count + 1) uint64 offsets of the paths in the blob
+    owners      path count uint32 package ids, padded to 8 bytes
+    blob        newline separated, byte-wise sorted paths
+
+Exact and prefix lookups are binary searches over the offsets table,
+substring and basename queries are a single regex scan over the mapped
+blob. Only owner ids of matched paths are ever decoded.
+"""
+
+import array
+import mmap
+import os
+import re
+import struct
+
+FILES_INDEX_MAGIC = b"EOPKGFIX"
+
+# bump this whenever the on-disk layout below changes
+FILES_INDEX_VERSION = 1
+
+_header = struct.Struct("=8sIQIIQ")
+
+
+def _align(size):
+    return (size + 7) & ~7
+
+
+def write(path, files, generation):
+    """Write an index for the (path, package) pairs in files to path"""
+    # paths with newlines can not be represented in the blob, they are
+    # still found through the exact FilesDB lookup
+    records = sorted((p.encode(), pkg) for p, pkg in files if "\n" not in p)
+    packages = sorted(set(pkg for p, pkg in records))
+    package_ids = dict((pkg, i) for i, pkg in enumerate(packages))
+    names = "\n".join(packages).encode()
+
+    offsets = array.array("Q")
+    owners = array.array("I")
+    blob = bytearray(b"\n")
+    for p, pkg in records:
+        offsets.append(len(blob))
+        blob += p
+        blob += b"\n"
+        owners.append(package_ids[pkg])
+    offsets.append(len(blob))
+
+    tmp_path = "%s.tmp" % path
+    with open(tmp_path, "wb") as f:
+        f.write(
+            _header.pack(
+                FILES_INDEX_MAGIC,
+                FILES_INDEX_VERSION,
+                generation,
+                len(packages),
+                len(records),
+                len(names),
+            )
+        )
+        f.write(names.ljust(_align(len(names)), b"\0"))
+        f.write(offsets.tobytes())
+        ids = owners.tobytes()
+        f.write(ids.ljust(_align(len(ids)), b"\0"))
+        f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+
+
+class FilesIndex:
+    def __init__(self, path):
+        self.path = path
+        self.generation = None
+        self.__map = None
+        self.__offsets = None
+        self.__owners = None
+        self.__open()
+
+    def __open(self):
+        try:
+            with open(self.path, "rb") as f:
+                self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # missing, unreadable or empty index
+            return
+
+        if len(self.__map) < _header.size:
+            self.close()
+            return
+
+        magic, version, generation, npackages, npaths, names_size = _header.unpack_from(
+            self.__map
+        )
+        if magic != FILES_INDEX_MAGIC or version != FILES_INDEX_VERSION:
+            self.close()
+            return
+
+        pos = _header.size
+        names = self.__map[pos : pos + names_size].decode()
+        self.packages = names.split("\n") if npackages else []
+        pos += _align(names_size)
+
+        view = memoryview(self.__map)
+        self.__offsets = view[pos : pos + 8 * (npaths + 1)].cast("Q")
+        pos += 8 * (npaths + 1)
+        self.__owners = view[pos : pos + 4 * npaths].cast("I")
+        pos += _align(4 * npaths)
+        view.release()
+
+        self.__blob = pos
+        self.__size = npaths
+        self.generation = generation
+
+    def is_valid(self):
+        return self.__map is not None
+
+    def close(self):
+        for view in (self.__offsets, self.__owners):
+            if view is not None:
+                view.release()
+        self.__offsets = self.__owners = None
+        if self.__map is not None:
+            self.__map.close()
+            self.__map = None
+        self.generation = None
+
+    def __len__(self):
+        return self.__size if self.is_valid() else 0
+
+    def __path(self, i):
+        start = self.__blob + self.__offsets[i]
+        end = self.__blob + self.__offsets[i + 1] - 1
+        return self.__map[start:end]
+
+    def __record(self, i):
+        return self.packages[self.__owners[i]], self.__path(i).decode()
+
+    def __lower_bound(self, key):
+        lo, hi = 0, self.__size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.__path(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def __index_at(self, pos):
+        # index of the path containing blob position pos
+        lo, hi = 0, self.__size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.__offsets[mid + 1] <= pos:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def items(self):
+        """Iterate over all (package, path) pairs in path order"""
+        for i in range(len(self)):
+            yield self.__record(i)
+
+    def lookup(self, path):
+        """Return the owner of path or None"""
+        if not self.is_valid():
+            return None
+        key = path.encode()
+        i = self.__lower_bound(key)
+        if i < self.__size and self.__path(i) == key:
+            return self.packages[self.__owners[i]]
+        return None
+
+    def prefix(self, prefix):
+        """Return the (package, path) pairs of all paths starting with prefix"""
+        if not self.is_valid():
+            return []
+        key = prefix.encode()
+        found = []
+        i = self.__lower_bound(key)
+        while i < self.__size:
+            path = self.__path(i)
+            if not path.startswith(key):
+                break
+            found.append((self.packages[self.__owners[i]], path.decode()))
+            i += 1
+        return found
+
+    def scan(self, pattern):
+        """Return the (package, path) pairs of all paths matching the
+        compiled bytes regex pattern. Matches must not span newlines."""
+        if not self.is_valid():
+            return []
+        found = []
+        last = None
+        for match in pattern.finditer(self.__map, self.__blob):
+            i = self.__index_at(match.start() - self.__blob)
+            if i != last and i < self.__size:
+                found.append(self.__record(i))
+                last = i
+        return found
+
+    def substring(self, term, ignore_case=True):
+        flags = re.I if ignore_case else 0
+        return self.scan(re.compile(re.escape(term.encode()), flags))
+
+    def basename(self, name):
+        # a plain literal search is much faster than a lookbehind, check the
+        # separator in front of the match afterwards
+        key = name.encode()
+        pattern = re.compile(re.escape(key) + b"\n")
+        return [
+            (pkg, path)
+            for pkg, path in self.scan(pattern)
+            if path.encode() == key or path.encode().endswith(b"/" + key)
+        ]
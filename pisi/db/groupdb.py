@@ -22,25 +22,13 @@ class GroupDB(lazydb.LazyDB):
         repodb = pisi.db.repodb.RepoDB()
 
         for repo in repodb.list_repos():
-            doc = repodb.get_repo_doc(repo)
-            group_nodes[repo] = self.__generate_groups(doc)
-            group_components[repo] = self.__generate_components(doc)
+            index = repodb.get_repo_index(repo)
+            group_nodes[repo] = index.groups
+            group_components[repo] = index.group_components
 
         self.gdb = pisi.db.itembyrepo.ItemByRepo(group_nodes)
         self.gcdb = pisi.db.itembyrepo.ItemByRepo(group_components)
 
-    def __generate_components(self, doc):
-        groups = {}
-        for c in doc.tags("Component"):
-            group = c.getTagData("Group")
-            if not group:
-                group = "unknown"
-            groups.setdefault(group, []).append(c.getTagData("Name"))
-        return groups
-
-    def __generate_groups(self, doc):
-        return dict([(x.getTagData("Name"), x.toString()) for x in doc.tags("Group")])
-
     def has_group(self, name, repo=None):
         return self.gdb.has_item(name, repo)
 
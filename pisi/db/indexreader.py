@@ -0,0 +1,380 @@
+# SPDX-FileCopyrightText: 2024 Solus Project
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Single pass, streaming reader for repository indexes.
+
+The index is read with expat, a SAX-style parser, straight from a memory
+map of the file. While a top level node is being parsed only the fields
+the databases need are collected; once it ends, it is turned into the
+rows of every table derived from it (packages, reverse dependencies,
+obsoletes, replaces, provides, components and groups) and forgotten. No
+document tree is ever built, and the XML of Package, Component and Group
+nodes is sliced from the file instead of being serialized again.
+"""
+
+import collections
+import mmap
+import time
+import xml.etree.ElementTree as ET
+import xml.parsers.expat
+import zlib
+
+import pisi.context as ctx
+import pisi.dependency
+
+# size of the blocks handed to the parser
+READ_BLOCK_SIZE = 1024 * 1024
+
+# what is collected from the nodes below the top level ones, by path
+TEXT, ATTRIBUTES, PRESENT = list(range(3))
+
+FIELDS = {
+    "Package": {
+        ("Name",): TEXT,
+        ("PartOf",): TEXT,
+        ("Replaces",): PRESENT,
+        ("IsA",): TEXT,
+        ("RuntimeDependencies", "Dependency"): ATTRIBUTES,
+        ("Provides", "PkgConfig"): TEXT,
+        ("Provides", "PkgConfig32"): TEXT,
+    },
+    "Distribution": {
+        ("SourceName",): TEXT,
+        ("Version",): TEXT,
+        ("Obsoletes", "Package"): TEXT,
+    },
+    "SpecFile": {("Source", "Name"): TEXT, ("Source", "PartOf"): TEXT},
+    "Component": {("Name",): TEXT, ("Group",): TEXT},
+    "Group": {("Name",): TEXT},
+}
+
+# top level nodes whose XML is kept
+XML_NODES = ("Package", "Component", "Group")
+
+Error = xml.parsers.expat.ExpatError
+
+
+class Node:
+    """Collected fields of a top level node"""
+
+    def __init__(self, tag):
+        self.tag = tag
+        self.xml = None
+        self.fields = {}  # path -> list of texts
+        self.attributes = {}  # path -> list of attribute dicts
+
+    def get(self, *path):
+        texts = self.fields.get(path)
+        return texts[0] if texts else None
+
+    def get_all(self, *path):
+        return self.fields.get(path, [])
+
+    def get_attributes(self, *path):
+        return self.attributes.get(path, [])
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+        self.start = self.last = time.perf_counter()
+
+    def lap(self, stage):
+        """Account the time since the previous lap to stage"""
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def __str__(self):
+        return ", ".join("%s %.3fs" % x for x in self.stages.items())
+
+
+class Reader:
+    """Calls handler with a Node for each top level node of the fed XML.
+
+    Only element events are handled in Python. Texts are sliced from data,
+    the whole document, and only handed to a real parser when they hold
+    markup or entities."""
+
+    def __init__(self, handler, data):
+        self.data = data
+        self.parser = parser = xml.parsers.expat.ParserCreate()
+
+        # the handlers run for every element of the index, keep them to
+        # closures over locals
+        starts = []  # start offsets of the open elements
+        push = starts.append
+        pop = starts.pop
+        state = {
+            "node": None,
+            "wanted": {},
+            "child": None,
+            "last_start": None,
+            "attrs": None,
+        }
+
+        def start(tag, attrs):
+            offset = parser.CurrentByteIndex
+            state["last_start"] = offset
+            state["attrs"] = attrs
+            push(offset)
+            depth = len(starts)
+            if depth == 3:
+                state["child"] = tag
+            elif depth == 2:
+                state["node"] = Node(tag)
+                state["wanted"] = FIELDS.get(tag, {})
+
+        def end(tag):
+            offset = pop()
+            depth = len(starts)
+            if depth > 3:
+                return
+            if depth == 3:
+                path = (state["child"], tag)
+            elif depth == 2:
+                path = (tag,)
+            elif depth == 1:
+                node = state["node"]
+                state["node"] = None
+                if node.tag in XML_NODES:
+                    node.xml = self.__xml(offset, state["last_start"])
+                handler(node)
+                return
+            else:
+                return
+
+            kind = state["wanted"].get(path)
+            if kind is None:
+                return
+            fields = state["node"].fields
+            if kind == PRESENT:
+                fields[path] = [""]
+                return
+            fields.setdefault(path, []).append(self.__text(offset, state["last_start"]))
+            if kind == ATTRIBUTES:
+                # only text follows the start tag of such elements
+                state["node"].attributes.setdefault(path, []).append(state["attrs"])
+
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+
+    def feed(self, block, final=False):
+        self.parser.Parse(block, final)
+
+    def __is_empty(self, start, last_start):
+        # an empty element <x/> is reported to end right after its start tag
+        offset = self.parser.CurrentByteIndex
+        return last_start == start and self.data[offset - 2 : offset] == b"/>"
+
+    def __xml(self, start, last_start):
+        if self.__is_empty(start, last_start):
+            return self.data[start : self.parser.CurrentByteIndex]
+        return self.data[start : self.data.find(b">", self.parser.CurrentByteIndex) + 1]
+
+    def __text(self, start, last_start):
+        if self.__is_empty(start, last_start):
+            return ""
+        text = self.data[self.data.find(b">", start) + 1 : self.parser.CurrentByteIndex]
+        if b"<" in text or b"&" in text or b'"' in text:
+            return ET.fromstring(self.__xml(start, last_start)).text or ""
+        return text.decode()
+
+
+class IndexTables:
+    """Tables derived from a repository index"""
+
+    def __init__(self):
+        self.packages = {}  # name -> compressed Package XML
+        self.revdeps = {}  # name -> set of (package, dependency tuple)
+        self.obsoletes = []
+        self.replaces = []  # packages replacing others
+        self.pkgconfigs = {}  # PkgConfig -> package
+        self.pkgconfigs32 = {}  # PkgConfig32 -> package
+        self.isas = {}  # IsA -> set of packages
+        self.components = {}  # name -> Component XML
+        self.component_packages = {}  # component -> packages
+        self.component_sources = {}  # component -> source packages
+        self.groups = {}  # name -> Group XML
+        self.group_components = {}  # group -> components
+        self.distribution = None  # (SourceName, Version)
+        self.source_repo = False
+
+    @staticmethod
+    def __dependencies(node):
+        deps = node.get_all("RuntimeDependencies", "Dependency")
+        attributes = node.get_attributes("RuntimeDependencies", "Dependency")
+        for dep, attrs in zip(deps, attributes):
+            yield pisi.dependency.dependency_tuple(dep, attrs)
+
+    def add_package(self, node, timer=None):
+        name = node.get("Name")
+        self.packages[name] = zlib.compress(node.xml)
+        if timer:
+            timer.lap("packages")
+
+        for dep in self.__dependencies(node):
+            self.revdeps.setdefault(dep[0], set()).add((name, dep))
+        if timer:
+            timer.lap("revdeps")
+
+        if node.get("Replaces") is not None:
+            self.replaces.append(name)
+        for pkgconfig in node.get_all("Provides", "PkgConfig"):
+            self.pkgconfigs[pkgconfig] = name
+        for pkgconfig in node.get_all("Provides", "PkgConfig32"):
+            self.pkgconfigs32[pkgconfig] = name
+        for isa in node.get_all("IsA"):
+            self.isas.setdefault(isa, set()).add(name)
+        if timer:
+            timer.lap("provides")
+
+        self.component_packages.setdefault(node.get("PartOf"), []).append(name)
+        if timer:
+            timer.lap("components")
+
+    def remove_package(self, name):
+        """Remove the rows added for package name, except its component.
+        Returns the PkgConfig and PkgConfig32 names which were provided by
+        it and have no provider left."""
+        if name not in self.packages:
+            return [], []
+        node = parse_node(zlib.decompress(self.packages.pop(name)))
+
+        for dep in self.__dependencies(node):
+            rows = self.revdeps.get(dep[0])
+            if rows is not None:
+                rows.discard((name, dep))
+                if not rows:
+                    del self.revdeps[dep[0]]
+
+        if name in self.replaces:
+            self.replaces.remove(name)
+        orphans = ([], [])
+        for providers, tag, removed in (
+            (self.pkgconfigs, "PkgConfig", orphans[0]),
+            (self.pkgconfigs32, "PkgConfig32", orphans[1]),
+        ):
+            for pkgconfig in node.get_all("Provides", tag):
+                if providers.get(pkgconfig) == name:
+                    del providers[pkgconfig]
+                    removed.append(pkgconfig)
+        for isa in node.get_all("IsA"):
+            packages = self.isas.get(isa)
+            if packages is not None:
+                packages.discard(name)
+                if not packages:
+                    del self.isas[isa]
+        return orphans
+
+    def find_providers(self, pkgconfigs, pkgconfigs32):
+        """Point the PkgConfig and PkgConfig32 names which have no provider
+        at the last package providing them, as reading the index would"""
+        wanted = (
+            (self.pkgconfigs, "PkgConfig", set(pkgconfigs) - set(self.pkgconfigs)),
+            (
+                self.pkgconfigs32,
+                "PkgConfig32",
+                set(pkgconfigs32) - set(self.pkgconfigs32),
+            ),
+        )
+        for name in reversed(list(self.packages)):
+            if not any(x[2] for x in wanted):
+                break
+            node = parse_node(zlib.decompress(self.packages[name]))
+            for providers, tag, missing in wanted:
+                for pkgconfig in node.get_all("Provides", tag):
+                    if pkgconfig in missing:
+                        providers[pkgconfig] = name
+                        missing.discard(pkgconfig)
+
+    def add_spec(self, node):
+        self.source_repo = True
+        self.component_sources.setdefault(node.get("Source", "PartOf"), []).append(
+            node.get("Source", "Name")
+        )
+
+    def add_distribution(self, node):
+        self.distribution = (node.get("SourceName"), node.get("Version"))
+        self.obsoletes = node.get_all("Obsoletes", "Package")
+
+    def add_component(self, node):
+        name = node.get("Name")
+        self.components[name] = node.xml.decode()
+        group = node.get("Group") or "unknown"
+        self.group_components.setdefault(group, []).append(name)
+
+    def add_group(self, node):
+        self.groups[node.get("Name")] = node.xml.decode()
+
+
+def parse_node(data):
+    """Return the Node of a single top level node serialized in data"""
+    nodes = []
+    # wrap it, the reader collects the children of the document element
+    data = b"<PISI>" + data + b"</PISI>"
+    reader = Reader(nodes.append, data)
+    reader.feed(data, True)
+    return nodes[0]
+
+
+class HeaderRead(Exception):
+    pass
+
+
+def read_index(path, header_only=False):
+    """Read the index at path into IndexTables in a single pass.
+
+    With header_only, reading stops at the first Package node. Only the
+    distribution and whether the index has source packages, which are
+    written before the packages, are known then."""
+    tables = IndexTables()
+    timer = StageTimer()
+
+    handlers = {
+        "Distribution": (tables.add_distribution, "distribution"),
+        "SpecFile": (tables.add_spec, "sources"),
+        "Component": (tables.add_component, "components"),
+        "Group": (tables.add_group, "groups"),
+    }
+
+    def handle(node):
+        timer.lap("parse")
+        if node.tag == "Package":
+            if header_only:
+                raise HeaderRead()
+            tables.add_package(node, timer)
+        elif node.tag in handlers:
+            handler, stage = handlers[node.tag]
+            handler(node)
+            timer.lap(stage)
+
+    with open(path, "rb") as f:
+        if not header_only:
+            ctx.ui.debug("Reading index %s" % path)
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            raise Error("no element found")
+
+        with data:
+            reader = Reader(handle, data)
+            try:
+                for offset in range(0, len(data), READ_BLOCK_SIZE):
+                    block = data[offset : offset + READ_BLOCK_SIZE]
+                    reader.feed(block, offset + READ_BLOCK_SIZE >= len(data))
+            except HeaderRead:
+                pass
+
+    # source repositories do not obsolete binary packages
+    if tables.source_repo:
+        tables.obsoletes = []
+
+    if not header_only:
+        timer.lap("parse")
+        ctx.ui.debug(
+            "Index %s read in %.3fs: %d packages (%s)"
+            % (path, timer.last - timer.start, len(tables.packages), timer)
+        )
+    return tables
@@ -6,6 +6,7 @@
 
 import os
 import re
+import time
 from pisi import translate as _
 
 import iksemel
@@ -65,7 +66,14 @@ class InstallDB(lazydb.LazyDB):
 
     def init(self):
         self.installed_db = self.__generate_installed_pkgs()
-        self.rev_deps_db = self.__generate_revdeps()
+        self.rev_deps_db = {}  # dependency -> {package: dependency tuple}
+        self.dep_edges_db = {}  # package -> dependencies it added to rev_deps_db
+        self.info_db = {}  # package -> (version, release, distro, distro_release, ctime, deps)
+        self.provides_db = {}  # package -> (pkgconfigs, pkgconfigs32, isas, build_host)
+        self.pkgconfig_db = {}  # pkgconfig -> package
+        self.pkgconfig32_db = {}  # pkgconfig32 -> package
+        self.isa_db = {}  # isa -> set of packages
+        self.__generate_indexes()
 
     def __generate_installed_pkgs(self):
         def split_name(dirname):
@@ -80,7 +88,7 @@ class InstallDB(lazydb.LazyDB):
             return open(info_path, "r").read().split()
         return []
 
-    def __add_to_revdeps(self, package, revdeps):
+    def __get_package_node(self, package):
         metadata_xml = os.path.join(self.package_path(package), ctx.const.metadata_xml)
         try:
             meta_doc = iksemel.parse(metadata_xml)
@@ -98,23 +106,125 @@ class InstallDB(lazydb.LazyDB):
                 % package
             )
             del self.installed_db[package]
-            return
 
+        return pkg
+
+    @staticmethod
+    def __dependency_tuple(dep):
+        attributes = {}
+        for attr in dep.attributes():
+            attr = attr.decode()
+            attributes[attr] = dep.getAttribute(attr)
+        return pisi.dependency.dependency_tuple(dep.firstChild().data(), attributes)
+
+    def __add_to_revdeps(self, package, pkg, revdeps):
+        edges = set()
         deps = pkg.getTag("RuntimeDependencies")
         if deps:
             for dep in deps.tags("Dependency"):
-                revdep = revdeps.setdefault(dep.firstChild().data(), {})
-                revdep[package] = dep.toString()
+                dep = self.__dependency_tuple(dep)
+                revdeps.setdefault(dep[0], {})[package] = dep
+                edges.add(dep[0])
             for anydep in deps.tags("AnyDependency"):
-                for dep in anydep.tags("Dependency"):
-                    revdep = revdeps.setdefault(dep.firstChild().data(), {})
-                    revdep[package] = anydep.toString()
+                anydep = tuple(self.__dependency_tuple(x) for x in anydep.tags("Dependency"))
+                for dep in anydep:
+                    revdeps.setdefault(dep[0], {})[package] = anydep
+                    edges.add(dep[0])
+        self.dep_edges_db[package] = edges
+
+    def __remove_from_revdeps(self, package):
+        # only the entries the package added, not the whole revdep table
+        for name in self.dep_edges_db.pop(package, ()):
+            revdep = self.rev_deps_db.get(name)
+            if revdep is not None:
+                revdep.pop(package, None)
+                if not revdep:
+                    del self.rev_deps_db[name]
+
+    def __add_to_info(self, package, pkg):
+        update = pkg.getTag("History").getTag("Update")
+        files_xml = os.path.join(self.package_path(package), ctx.const.files_xml)
+        try:
+            ctime = os.stat(files_xml).st_ctime
+        except OSError:
+            ctime = None
+
+        deps = []
+        rdeps = pkg.getTag("RuntimeDependencies")
+        if rdeps:
+            deps = [x.firstChild().data() for x in rdeps.tags("Dependency")]
+            for anydep in rdeps.tags("AnyDependency"):
+                deps.extend(x.firstChild().data() for x in anydep.tags("Dependency"))
+
+        self.info_db[package] = (
+            update.getTagData("Version"),
+            update.getAttribute("release"),
+            pkg.getTagData("Distribution"),
+            pkg.getTagData("DistributionRelease"),
+            ctime,
+            deps,
+        )
+
+    def __add_to_provides(self, package, pkg):
+        pkgconfigs = []
+        pkgconfigs32 = []
+        prov = pkg.getTag("Provides")
+        if prov:
+            pkgconfigs = [x.firstChild().data() for x in prov.tags("PkgConfig")]
+            pkgconfigs32 = [x.firstChild().data() for x in prov.tags("PkgConfig32")]
+        isas = [x.firstChild().data() for x in pkg.tags("IsA")]
+        build_host = pkg.getTagData("BuildHost")
+
+        self.provides_db[package] = (pkgconfigs, pkgconfigs32, isas, build_host)
+        for pc in pkgconfigs:
+            self.pkgconfig_db[pc] = package
+        for pc in pkgconfigs32:
+            self.pkgconfig32_db[pc] = package
+        for isa in isas:
+            self.isa_db.setdefault(isa, set()).add(package)
+
+    def __remove_from_provides(self, package):
+        if package not in self.provides_db:
+            return
+
+        pkgconfigs, pkgconfigs32, isas, build_host = self.provides_db.pop(package)
+        for pc in pkgconfigs:
+            if self.pkgconfig_db.get(pc) == package:
+                self.__repoint_provider(self.pkgconfig_db, 0, pc)
+        for pc in pkgconfigs32:
+            if self.pkgconfig32_db.get(pc) == package:
+                self.__repoint_provider(self.pkgconfig32_db, 1, pc)
+        for isa in isas:
+            packages = self.isa_db.get(isa)
+            if packages is not None:
+                packages.discard(package)
+                if not packages:
+                    del self.isa_db[isa]
+
+    def __repoint_provider(self, db, field, pc):
+        # another installed package may provide the same pkgconfig, the
+        # last one indexed wins as when the indexes are generated
+        provider = None
+        for name, provides in self.provides_db.items():
+            if pc in provides[field]:
+                provider = name
+        if provider is None:
+            del db[pc]
+        else:
+            db[pc] = provider
 
-    def __generate_revdeps(self):
-        revdeps = {}
+    def __index_package(self, package):
+        pkg = self.__get_package_node(package)
+        if pkg is None:
+            return
+
+        self.__add_to_revdeps(package, pkg, self.rev_deps_db)
+        self.__add_to_info(package, pkg)
+        self.__add_to_provides(package, pkg)
+
+    def __generate_indexes(self):
         for package in self.list_installed():
-            self.__add_to_revdeps(package, revdeps)
-        return revdeps
+            self.__index_package(package)
 
     def list_installed(self):
         return list(self.installed_db.keys())
@@ -123,15 +233,11 @@ class InstallDB(lazydb.LazyDB):
         return package in self.installed_db
 
     def list_installed_with_build_host(self, build_host):
-        build_host_re = re.compile("<BuildHost>(.*?)</BuildHost>")
         found = []
         for name in self.list_installed():
-            xml = open(
-                os.path.join(self.package_path(name), ctx.const.metadata_xml)
-            ).read()
-            matched = build_host_re.search(xml)
-            if matched:
-                if build_host != matched.groups()[0]:
+            host = self.provides_db[name][3] if name in self.provides_db else None
+            if host is not None:
+                if build_host != host:
                     continue
             elif build_host:
                 continue
@@ -140,29 +246,24 @@ class InstallDB(lazydb.LazyDB):
 
         return found
 
-    def __get_version(self, meta_doc):
-        history = meta_doc.getTag("Package").getTag("History")
-        version = history.getTag("Update").getTagData("Version")
-        release = history.getTag("Update").getAttribute("release")
-
-        # TODO Remove None
-        return version, release, None
-
-    def __get_distro_release(self, meta_doc):
-        distro = meta_doc.getTag("Package").getTagData("Distribution")
-        release = meta_doc.getTag("Package").getTagData("DistributionRelease")
-
-        return distro, release
+    def __get_info_record(self, package):
+        if package not in self.info_db:
+            raise Exception(_("Package %s is not installed") % package)
+        return self.info_db[package]
 
     def get_version_and_distro_release(self, package):
-        metadata_xml = os.path.join(self.package_path(package), ctx.const.metadata_xml)
-        meta_doc = iksemel.parse(metadata_xml)
-        return self.__get_version(meta_doc) + self.__get_distro_release(meta_doc)
+        version, release, distro, distro_release = self.__get_info_record(package)[:4]
+        # TODO Remove None
+        return version, release, None, distro, distro_release
 
     def get_version(self, package):
-        metadata_xml = os.path.join(self.package_path(package), ctx.const.metadata_xml)
-        meta_doc = iksemel.parse(metadata_xml)
-        return self.__get_version(meta_doc)
+        version, release = self.__get_info_record(package)[:2]
+        # TODO Remove None
+        return version, release, None
+
+    def get_dependencies(self, package):
+        """Return the names of the runtime dependencies of an installed package"""
+        return list(self.__get_info_record(package)[5])
 
     def get_files(self, package):
         files = pisi.files.Files()
@@ -212,55 +313,27 @@ class InstallDB(lazydb.LazyDB):
         return found
 
     def get_isa_packages(self, isa):
-        risa = "<IsA>%s</IsA>" % isa
-        packages = []
-        for name in self.list_installed():
-            xml = open(
-                os.path.join(self.package_path(name), ctx.const.metadata_xml)
-            ).read()
-            if re.compile(risa).search(xml):
-                packages.append(name)
-        return packages
+        return list(self.isa_db.get(isa, ()))
 
     def get_info(self, package):
-        files_xml = os.path.join(self.package_path(package), ctx.const.files_xml)
-        ctime = pisi.util.creation_time(files_xml)
-        pkg = self.get_package(package)
+        version, release, distro, distro_release, ctime = self.__get_info_record(
+            package
+        )[:5]
+        if ctime is not None:
+            ctime = time.localtime(ctime)
         state = "i"
-        if pkg.name in self.list_pending():
+        if package in self.list_pending():
             state = "ip"
 
-        info = InstallInfo(state, pkg.version, pkg.release, pkg.distribution, ctime)
+        info = InstallInfo(state, version, release, distro, ctime)
         return info
 
-    def __make_dependency(self, depStr):
-        node = iksemel.parseString(depStr)
-        dependency = pisi.dependency.Dependency()
-        dependency.package = node.firstChild().data()
-        if node.attributes():
-            attr = node.attributes()[0].decode()
-            dependency.__dict__[attr] = node.getAttribute(attr)
-        return dependency
-
-    def __create_dependency(self, depStr: str):
-        if "<AnyDependency>" in depStr:
-            anydependency = pisi.specfile.AnyDependency()
-            for dep in re.compile("(<Dependency .*?>.*?</Dependency>)").findall(depStr):
-                anydependency.dependencies.append(self.__make_dependency(dep))
-            return anydependency
-        else:
-            return self.__make_dependency(depStr)
-
     def get_rev_deps(self, name):
-        rev_deps = []
-
-        package_revdeps = self.rev_deps_db.get(name)
-        if package_revdeps:
-            for pkg, dep in list(package_revdeps.items()):
-                dependency = self.__create_dependency(dep)
-                rev_deps.append((pkg, dependency))
-
-        return rev_deps
+        package_revdeps = self.rev_deps_db.get(name, {})
+        return [
+            (pkg, pisi.dependency.make_dependency(dep))
+            for pkg, dep in package_revdeps.items()
+        ]
 
     def pkg_dir(self, pkg, version, release):
         return pisi.util.join_path(
@@ -274,20 +347,14 @@ class InstallDB(lazydb.LazyDB):
         return metadata.package
 
     def get_package_by_pkgconfig(self, pkgconfig):
-        for item in self.list_installed():
-            pkg = self.get_package(item)
-            if pkg.providesPkgConfig is not None and len(pkg.providesPkgConfig) > 0:
-                for pc in pkg.providesPkgConfig:
-                    if pc.om == pkgconfig:
-                        return pkg
+        name = self.pkgconfig_db.get(pkgconfig)
+        if name is not None and self.has_package(name):
+            return self.get_package(name)
 
     def get_package_by_pkgconfig32(self, pkgconfig):
-        for item in self.list_installed():
-            pkg = self.get_package(item)
-            if pkg.providesPkgConfig32 is not None and len(pkg.providesPkgConfig32) > 0:
-                for pc in pkg.providesPkgConfig32:
-                    if pc.om == pkgconfig:
-                        return pkg
+        name = self.pkgconfig32_db.get(pkgconfig)
+        if name is not None and self.has_package(name):
+            return self.get_package(name)
 
     def __mark_package(self, _type, package):
         packages = self.__get_marked_packages(_type)
@@ -309,23 +376,24 @@ class InstallDB(lazydb.LazyDB):
 
     def add_package(self, pkginfo):
         # Cleanup old revdep info
-        for revdep_info in list(self.rev_deps_db.values()):
-            if pkginfo.name in revdep_info:
-                del revdep_info[pkginfo.name]
+        self.__remove_from_revdeps(pkginfo.name)
+        self.__remove_from_provides(pkginfo.name)
 
         self.installed_db[pkginfo.name] = "%s-%s" % (pkginfo.version, pkginfo.release)
-        self.__add_to_revdeps(pkginfo.name, self.rev_deps_db)
+        self.__index_package(pkginfo.name)
+        pisi.db.upgradabledb.UpgradableDB().invalidate()
 
     def remove_package(self, package_name):
         if package_name in self.installed_db:
             del self.installed_db[package_name]
+        self.info_db.pop(package_name, None)
 
         # Cleanup revdep info
-        for revdep_info in list(self.rev_deps_db.values()):
-            if package_name in revdep_info:
-                del revdep_info[package_name]
+        self.__remove_from_revdeps(package_name)
+        self.__remove_from_provides(package_name)
 
         self.clear_pending(package_name)
+        pisi.db.upgradabledb.UpgradableDB().invalidate()
 
     def list_pending(self):
         return self.__get_marked_packages(ctx.const.config_pending)
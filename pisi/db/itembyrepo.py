@@ -29,16 +29,20 @@ class ItemByRepo:
 
         raise Exception(_("%s not found in any repository.") % str(item))
 
-    def get_item_repo(self, item, repo=None):
+    def find_repo(self, item, repo=None):
         for r in self.item_repos(repo):
             if r in self.dbobj and item in self.dbobj[r]:
-                if self.compressed:
-                    return zlib.decompress(self.dbobj[r][item]), r
-                else:
-                    return self.dbobj[r][item], r
+                return r
 
         raise Exception(_("Repo item %s not found") % str(item))
 
+    def get_item_repo(self, item, repo=None):
+        r = self.find_repo(item, repo)
+        if self.compressed:
+            return zlib.decompress(self.dbobj[r][item]), r
+        else:
+            return self.dbobj[r][item], r
+
     def get_item(self, item, repo=None):
         item, repo = self.get_item_repo(item, repo)
         return item
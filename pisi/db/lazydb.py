@@ -40,10 +40,14 @@ class Singleton(object):
 # are written to disk in all LazyDB caches
 LAZYDB_PICKLE_PROTOCOL_VERSION = 2
 
+# bump this whenever the layout of the pickled LazyDB caches changes, so that
+# stale caches written by the same eopkg version are regenerated
+LAZYDB_CACHE_FORMAT = 6
+
 class LazyDB(Singleton):
 
     # Make sure that caches get invalidated when switching between pisi/eopkg versions
-    cache_version = pisi.__version__
+    cache_version = "%s-%d" % (pisi.__version__, LAZYDB_CACHE_FORMAT)
 
     def __init__(self, cacheable=False, cachedir=None):
         if "initialized" not in self.__dict__:
@@ -69,8 +73,15 @@ class LazyDB(Singleton):
                 f.write(LazyDB.cache_version)
                 f.flush()
                 os.fsync(f.fileno())
-            pickle.dump(self._instance, open(self.__cache_file(), "wb"),
-                         protocol=LAZYDB_PICKLE_PROTOCOL_VERSION)
+            # write to a temporary file first so that a crash never leaves
+            # a truncated cache behind
+            tmp_file = "%s.tmp" % self.__cache_file()
+            with open(tmp_file, "wb") as f:
+                pickle.dump(self._instance, f,
+                            protocol=LAZYDB_PICKLE_PROTOCOL_VERSION)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_file, self.__cache_file())
 
     def cache_valid(self):
         try:
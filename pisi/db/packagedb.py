@@ -6,9 +6,9 @@
 
 import re
 import time
-import gzip
 import gettext
 import datetime
+import collections
 
 import iksemel
 
@@ -16,70 +16,119 @@ import pisi.db
 import pisi.metadata
 import pisi.dependency
 import pisi.db.itembyrepo
+import pisi.db.indexreader as indexreader
 import pisi.db.lazydb as lazydb
+import pisi.context as ctx
 from pisi import translate as _
 
+# upper bound for the number of decoded packages kept by PackageCache
+PACKAGE_CACHE_SIZE = 4096
+
+
+class PackageCache:
+    """Bounded LRU of parsed metadata.Package objects keyed by (repo, name).
+
+    It lives outside of PackageDB so that it is never pickled into the
+    LazyDB cache, and it is cleared whenever PackageDB is invalidated or
+    regenerated (e.g. on repository updates).
+    """
+
+    def __init__(self, size=PACKAGE_CACHE_SIZE):
+        self.size = size
+        self.packages = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        package = self.packages.get(key)
+        if package is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.packages.move_to_end(key)
+        return package
+
+    def add(self, key, package):
+        self.packages[key] = package
+        self.packages.move_to_end(key)
+        while len(self.packages) > self.size:
+            self.packages.popitem(last=False)
+
+    def clear(self):
+        if self.hits or self.misses:
+            ctx.ui.debug(
+                "PackageDB package cache: %d hits, %d misses, %d cached."
+                % (self.hits, self.misses, len(self.packages))
+            )
+        self.packages.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+package_cache = PackageCache()
+
 
 class PackageDB(lazydb.LazyDB):
     def __init__(self):
         lazydb.LazyDB.__init__(self, cacheable=True)
 
     def init(self):
+        package_cache.clear()
+
         self.__package_nodes = {}  # Packages
         self.__revdeps = {}  # Reverse dependencies
         self.__obsoletes = {}  # Obsoletes
         self.__replaces = {}  # Replaces
+        self.__pkgconfigs = {}  # PkgConfig providers
+        self.__pkgconfigs32 = {}  # PkgConfig32 providers
+        self.__isas = {}  # IsA -> packages
 
         repodb = pisi.db.repodb.RepoDB()
 
         for repo in repodb.list_repos():
-            doc = repodb.get_repo_doc(repo)
-            self.__package_nodes[repo] = self.__generate_packages(doc)
-            self.__revdeps[repo] = self.__generate_revdeps(doc)
-            self.__obsoletes[repo] = self.__generate_obsoletes(doc)
-            self.__replaces[repo] = self.__generate_replaces(doc)
+            index = repodb.get_repo_index(repo)
+            self.__package_nodes[repo] = index.packages
+            self.__revdeps[repo] = index.revdeps
+            self.__obsoletes[repo] = index.obsoletes
+            self.__replaces[repo] = index.replaces
+            self.__pkgconfigs[repo] = index.pkgconfigs
+            self.__pkgconfigs32[repo] = index.pkgconfigs32
+            self.__isas[repo] = index.isas
 
         self.pdb = pisi.db.itembyrepo.ItemByRepo(self.__package_nodes, compressed=True)
         self.rvdb = pisi.db.itembyrepo.ItemByRepo(self.__revdeps)
         self.odb = pisi.db.itembyrepo.ItemByRepo(self.__obsoletes)
         self.rpdb = pisi.db.itembyrepo.ItemByRepo(self.__replaces)
-
-    def __generate_replaces(self, doc):
-        return [
-            x.getTagData("Name")
-            for x in doc.tags("Package")
-            if x.getTagData("Replaces")
-        ]
-
-    def __generate_obsoletes(self, doc):
-        distribution = doc.getTag("Distribution")
-        obsoletes = distribution and distribution.getTag("Obsoletes")
-        src_repo = doc.getTag("SpecFile") is not None
-
-        if not obsoletes or src_repo:
-            return []
-
-        return [x.firstChild().data() for x in obsoletes.tags("Package")]
-
-    def __generate_packages(self, doc):
-        return dict(
-            [
-                (x.getTagData("Name"), gzip.zlib.compress(x.toString().encode()))
-                for x in doc.tags("Package")
-            ]
-        )
-
-    def __generate_revdeps(self, doc):
-        revdeps = {}
-        for node in doc.tags("Package"):
-            name = node.getTagData("Name")
-            deps = node.getTag("RuntimeDependencies")
-            if deps:
-                for dep in deps.tags("Dependency"):
-                    revdeps.setdefault(dep.firstChild().data(), set()).add(
-                        (name, dep.toString())
-                    )
-        return revdeps
+        self.pcdb = pisi.db.itembyrepo.ItemByRepo(self.__pkgconfigs)
+        self.pc32db = pisi.db.itembyrepo.ItemByRepo(self.__pkgconfigs32)
+
+    def apply_index_delta(self, repo, delta):
+        """Patch the tables of repo with a pisi.indexdelta.IndexDelta
+        instead of regenerating them from the whole index. Returns False
+        if that is not possible."""
+        if repo not in self.__package_nodes or not delta.has_packages_only():
+            return False
+
+        package_cache.clear()
+        tables = indexreader.IndexTables()
+        tables.packages = self.__package_nodes[repo]
+        tables.revdeps = self.__revdeps[repo]
+        tables.replaces = self.__replaces[repo]
+        tables.pkgconfigs = self.__pkgconfigs[repo]
+        tables.pkgconfigs32 = self.__pkgconfigs32[repo]
+        tables.isas = self.__isas[repo]
+
+        pkgconfigs, pkgconfigs32 = [], []
+        for name in set(delta.removed).union(delta.packages):
+            orphans = tables.remove_package(name)
+            pkgconfigs.extend(orphans[0])
+            pkgconfigs32.extend(orphans[1])
+        for xml in delta.packages.values():
+            tables.add_package(indexreader.parse_node(xml.encode()))
+        # another package may still provide what a removed one did
+        tables.find_providers(pkgconfigs, pkgconfigs32)
+
+        return True
 
     def has_package(self, name, repo=None):
         return self.pdb.has_item(name, repo)
@@ -96,36 +145,33 @@ class PackageDB(lazydb.LazyDB):
         The second dict ([1]) contains the pkgconfig32 mapping to
         package name.
         """
-        repodb = pisi.db.repodb.RepoDB()
-
         pkgConfigs = dict()
         pkgConfigs32 = dict()
 
-        for repo in repodb.list_repos(repo):
-            doc = repodb.get_repo_doc(repo)
-            for pkg in doc.tags("Package"):
-                prov = pkg.getTag("Provides")
-                name = pkg.getTagData("Name")
-                if not prov:
-                    continue
-                for node in prov.tags("PkgConfig32"):
-                    pkgConfigs32[node.firstChild().data()] = name
-                for node in prov.tags("PkgConfig"):
-                    pkgConfigs[node.firstChild().data()] = name
+        for r in self.pcdb.item_repos(repo):
+            pkgConfigs.update(self.__pkgconfigs.get(r, {}))
+            pkgConfigs32.update(self.__pkgconfigs32.get(r, {}))
         return (pkgConfigs, pkgConfigs32)
 
+    def __get_pkgconfig_provider(self, pkgconfig, providers):
+        # Later repositories override earlier ones, as in get_pkgconfig_providers
+        for repo in reversed(self.pcdb.item_repos()):
+            if pkgconfig in providers.get(repo, {}):
+                return providers[repo][pkgconfig]
+        return None
+
     def get_package_by_pkgconfig(self, pkgconfig):
         """This method is deprecated. Use get_pkgconfig_providers instead"""
-        provs = self.get_pkgconfig_providers()[0]
-        if pkgconfig in provs:
-            return self.get_package(provs[pkgconfig])
+        name = self.__get_pkgconfig_provider(pkgconfig, self.__pkgconfigs)
+        if name:
+            return self.get_package(name)
         return None
 
     def get_package_by_pkgconfig32(self, pkgconfig):
         """This method is deprecated. Use get_pkgconfig_providers instead"""
-        provs = self.get_pkgconfig_providers()[1]
-        if pkgconfig in provs:
-            return self.get_package(provs[pkgconfig])
+        name = self.__get_pkgconfig_provider(pkgconfig, self.__pkgconfigs32)
+        if name:
+            return self.get_package(name)
         return None
 
     def search_in_packages(self, packages, terms, lang=None):
@@ -208,11 +254,19 @@ class PackageDB(lazydb.LazyDB):
         return self.__get_version(pkg_doc)
 
     def get_package_repo(self, name, repo=None):
-        pkg, repo = self.pdb.get_item_repo(name, repo)
-        package = pisi.metadata.Package()
-        package.parse(pkg)
+        repo = self.pdb.find_repo(name, repo)
+        package = package_cache.get((repo, name))
+        if package is None:
+            package = pisi.metadata.Package()
+            package.parse(self.pdb.get_item(name, repo))
+            package_cache.add((repo, name), package)
         return package, repo
 
+    def invalidate(self):
+        package_cache.clear()
+        pisi.db.upgradabledb.UpgradableDB().invalidate()
+        lazydb.LazyDB.invalidate(self)
+
     def which_repo(self, name):
         return self.pdb.which_repo(name)
 
@@ -220,16 +274,9 @@ class PackageDB(lazydb.LazyDB):
         return self.odb.get_list_item(repo)
 
     def get_isa_packages(self, isa):
-        repodb = pisi.db.repodb.RepoDB()
-
         packages = set()
-        for repo in repodb.list_repos():
-            doc = repodb.get_repo_doc(repo)
-            for package in doc.tags("Package"):
-                if package.getTagData("IsA"):
-                    for node in package.tags("IsA"):
-                        if node.firstChild().data() == isa:
-                            packages.add(package.getTagData("Name"))
+        for repo in self.pdb.item_repos():
+            packages.update(self.__isas.get(repo, {}).get(isa, ()))
         return list(packages)
 
     def get_rev_deps(self, name, repo=None):
@@ -240,16 +287,7 @@ class PackageDB(lazydb.LazyDB):
         ):  # FIXME: what exception could we catch here, replace with that.
             return []
 
-        rev_deps = []
-        for pkg, dep in rvdb:
-            node = iksemel.parseString(dep)
-            dependency = pisi.dependency.Dependency()
-            dependency.package = node.firstChild().data()
-            if node.attributes():
-                attr = node.attributes()[0].decode()
-                dependency.__dict__[attr] = node.getAttribute(attr)
-            rev_deps.append((pkg, dependency))
-        return rev_deps
+        return [(pkg, pisi.dependency.make_dependency(dep)) for pkg, dep in rvdb]
 
     # replacesdb holds the info about the replaced packages (ex. gaim -> pidgin)
     def get_replaces(self, repo=None):
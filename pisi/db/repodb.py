@@ -12,6 +12,7 @@ import pisi.uri
 import pisi.util
 import pisi.context as ctx
 import pisi.db.lazydb as lazydb
+import pisi.db.indexreader as indexreader
 import pisi.urlcheck
 from pisi.file import File
 
@@ -166,6 +167,7 @@ class RepoOrder:
 class RepoDB(lazydb.LazyDB):
     def init(self):
         self.repoorder = RepoOrder()
+        self.indexes = {}  # repo -> (index file stat, IndexTables, full tables)
 
         if len(self.repoorder.repos) == 0:
             repo = pisi.db.repodb.Repo(
@@ -180,7 +182,7 @@ class RepoDB(lazydb.LazyDB):
     def has_repo_url(self, url, only_active=True):
         return url in self.list_repo_urls(only_active)
 
-    def get_repo_doc(self, repo_name):
+    def get_repo_index_path(self, repo_name):
         repo = self.get_repo(repo_name)
 
         index_path = repo.indexuri.get_uri()
@@ -193,18 +195,53 @@ class RepoDB(lazydb.LazyDB):
             if File.is_compressed(index_path):
                 index_path = os.path.splitext(index_path)[0]
 
-        if not os.path.exists(index_path):
-            ctx.ui.warning(_("%s repository needs to be updated") % repo_name)
-            return iksemel.newDocument("PISI")
+        return index_path
+
+    def get_repo_index(self, repo_name, header_only=False):
+        """Return the pisi.db.indexreader.IndexTables of repo_name.
+
+        The index is read once and shared by PackageDB, ComponentDB and
+        GroupDB until release_indexes is called or it changes on disk.
+        With header_only, only the distribution and source_repo fields are
+        read if the full tables are not at hand."""
+        index_path = self.get_repo_index_path(repo_name)
 
         try:
-            return iksemel.parse(index_path)
-        except Exception as e:
-            raise RepoError(
-                _(
-                    "Error parsing repository index information. Index file does not exist or is malformed."
+            st = os.stat(index_path)
+            key = (index_path, st.st_mtime_ns, st.st_size)
+        except OSError:
+            key = None
+
+        cached = self.indexes.get(repo_name)
+        if cached is not None and cached[0] == key and (header_only or cached[2]):
+            return cached[1]
+
+        if key is None:
+            ctx.ui.warning(_("%s repository needs to be updated") % repo_name)
+            tables = indexreader.IndexTables()
+        else:
+            try:
+                tables = indexreader.read_index(index_path, header_only)
+            except indexreader.Error:
+                raise RepoError(
+                    _(
+                        "Error parsing repository index information. Index file does not exist or is malformed."
+                    )
                 )
-            )
+            if header_only:
+                return tables
+
+        self.indexes[repo_name] = (key, tables, True)
+        return tables
+
+    def release_indexes(self):
+        """Keep only the header of the indexes read so far, once PackageDB,
+        ComponentDB and GroupDB have taken their tables"""
+        for repo_name, (key, tables, full) in list(self.indexes.items()):
+            header = indexreader.IndexTables()
+            header.distribution = tables.distribution
+            header.source_repo = tables.source_repo
+            self.indexes[repo_name] = (key, header, False)
 
     def get_repo(self, repo):
         return Repo(pisi.uri.URI(self.get_repo_url(repo)))
@@ -240,20 +277,21 @@ class RepoDB(lazydb.LazyDB):
         self.repoorder.add(name, repo_info.indexuri.get_uri())
 
     def remove_repo(self, name):
+        self.indexes.pop(name, None)
         pisi.util.clean_dir(os.path.join(ctx.config.index_dir(), name))
         self.repoorder.remove(name)
 
     def get_source_repos(self, only_active=True):
         repos = []
         for r in self.list_repos(only_active):
-            if self.get_repo_doc(r).getTag("SpecFile"):
+            if self.get_repo_index(r, header_only=True).source_repo:
                 repos.append(r)
         return repos
 
     def get_binary_repos(self, only_active=True):
         repos = []
         for r in self.list_repos(only_active):
-            if not self.get_repo_doc(r).getTag("SpecFile"):
+            if not self.get_repo_index(r, header_only=True).source_repo:
                 repos.append(r)
         return repos
 
@@ -288,14 +326,12 @@ class RepoDB(lazydb.LazyDB):
         return self.repoorder.get_status(name) == "active"
 
     def get_distribution(self, name):
-        doc = self.get_repo_doc(name)
-        distro = doc.getTag("Distribution")
-        return distro and distro.getTagData("SourceName")
+        distro = self.get_repo_index(name, header_only=True).distribution
+        return distro and distro[0]
 
     def get_distribution_release(self, name):
-        doc = self.get_repo_doc(name)
-        distro = doc.getTag("Distribution")
-        return distro and distro.getTagData("Version")
+        distro = self.get_repo_index(name, header_only=True).distribution
+        return distro and distro[1]
 
     def check_distribution(self, name):
         if ctx.get_option("ignore_check"):
@@ -0,0 +1,47 @@
+# SPDX-FileCopyrightText: 2024 Solus Project
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import pisi
+import pisi.blacklist
+import pisi.db.installdb
+import pisi.db.packagedb
+import pisi.db.lazydb as lazydb
+import pisi.context as ctx
+
+
+class UpgradableDB(lazydb.LazyDB):
+    """Installed packages which have an upgrade in the repositories.
+
+    Finding them takes a look at the repository version of every installed
+    package, so it is done once and kept until the installed packages or
+    the repositories change, which invalidates it."""
+
+    def __init__(self):
+        lazydb.LazyDB.__init__(self, cacheable=False)
+
+    def init(self):
+        import pisi.operations.upgrade
+
+        installdb = pisi.db.installdb.InstallDB()
+        is_upgradable = pisi.operations.upgrade.is_upgradable
+
+        upgradable = list(filter(is_upgradable, installdb.list_installed()))
+        self.upgradable = set(upgradable)
+
+        # replaced packages can not pass is_upgradable test, so we add them manually
+        upgradable.extend(pisi.db.packagedb.PackageDB().get_replaces())
+
+        # consider also blacklist filtering
+        self.upgrades = pisi.blacklist.exclude_from(upgradable, ctx.const.blacklist)
+        self.upgrades_set = set(self.upgrades)
+
+    def is_upgradable(self, name):
+        """True if the installed package name has a newer release in the
+        repositories, see pisi.operations.upgrade.is_upgradable"""
+        return name in self.upgradable
+
+    def has_upgrade(self, name):
+        return name in self.upgrades_set
+
+    def list_upgradable(self):
+        return list(self.upgrades)
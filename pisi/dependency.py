@@ -68,3 +68,41 @@ class Dependency(pisi.relation.Relation):
     # Added for AnyDependency, single Dependency always returns False
     def satisfied_by_any_installed_other_than(self, package):
         return False
+
+
+# attributes of a Dependency, in the order they follow the package name in
+# the tuples the package databases store reverse dependencies as
+DEPENDENCY_FIELDS = (
+    "version",
+    "versionFrom",
+    "versionTo",
+    "release",
+    "releaseFrom",
+    "releaseTo",
+    "type",
+)
+
+
+def dependency_tuple(package, attributes):
+    """Return the tuple form of a Dependency on package, attributes being
+    a dict of its XML attributes"""
+    return (package,) + tuple(attributes.get(x) for x in DEPENDENCY_FIELDS)
+
+
+def make_dependency(fields):
+    """Return a new Dependency of a tuple made by dependency_tuple(), or the
+    AnyDependency of a tuple of them"""
+    if isinstance(fields[0], tuple):
+        import pisi.specfile
+
+        anydependency = pisi.specfile.AnyDependency()
+        anydependency.dependencies = [make_dependency(x) for x in fields]
+        anydependency.package = anydependency.dependencies[0].package
+        return anydependency
+
+    dependency = Dependency()
+    dependency.package = fields[0]
+    for name, value in zip(DEPENDENCY_FIELDS, fields[1:]):
+        if value is not None:
+            setattr(dependency, name, value)
+    return dependency
@@ -0,0 +1,206 @@
+# SPDX-FileCopyrightText: 2024 Solus Project
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Reads what the build needs to know about ELF objects: the soname,
+NEEDED entries, RPATH, RUNPATH and the GNU Build-ID.
+
+The file is memory mapped and only its headers, dynamic section, dynamic
+string table and notes are looked at, instead of running readelf and
+parsing its output. Results are cached per path for as long as the inode
+and mtime of the file stay the same.
+"""
+
+import collections
+import mmap
+import os
+import struct
+
+ELF_MAGIC = b"\x7fELF"
+ELFCLASS32, ELFCLASS64 = 1, 2
+ELFDATA2LSB, ELFDATA2MSB = 1, 2
+
+PT_LOAD, PT_DYNAMIC, PT_NOTE = 1, 2, 4
+SHT_DYNAMIC, SHT_NOTE, SHT_NOBITS = 6, 7, 8
+DT_NULL, DT_NEEDED, DT_STRTAB, DT_SONAME, DT_RPATH, DT_RUNPATH = 0, 1, 5, 14, 15, 29
+NT_GNU_BUILD_ID = 3
+
+# layouts by class: file header after e_ident, program header, section
+# header and dynamic entry
+_LAYOUTS = {
+    ELFCLASS32: ("HHIIIIIHHHHHH", "IIIIIIII", "IIIIIIIIII", "iI"),
+    ELFCLASS64: ("HHIQQQIHHHHHH", "IIQQQQQQ", "IIQQQQIIQQ", "qQ"),
+}
+
+ElfInfo = collections.namedtuple(
+    "ElfInfo", ["soname", "needed", "rpath", "runpath", "build_id"]
+)
+
+_cache = {}  # path -> ((inode, mtime), ElfInfo or None)
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        if data[:4] != ELF_MAGIC:
+            raise ValueError("not an ELF object")
+        elfclass, encoding = data[4], data[5]
+        if elfclass not in _LAYOUTS or encoding not in (ELFDATA2LSB, ELFDATA2MSB):
+            raise ValueError("unknown ELF class or data encoding")
+
+        order = "<" if encoding == ELFDATA2LSB else ">"
+        header, phdr, shdr, dyn = _LAYOUTS[elfclass]
+        self.phdr = struct.Struct(order + phdr)
+        self.shdr = struct.Struct(order + shdr)
+        self.dyn = struct.Struct(order + dyn)
+        self.note = struct.Struct(order + "III")
+        self.elf64 = elfclass == ELFCLASS64
+
+        (
+            self.type,
+            machine,
+            version,
+            entry,
+            self.phoff,
+            self.shoff,
+            flags,
+            ehsize,
+            self.phentsize,
+            self.phnum,
+            self.shentsize,
+            self.shnum,
+            shstrndx,
+        ) = struct.unpack_from(order + header, data, 16)
+
+    def segments(self):
+        """Yield (type, offset, vaddr, filesz) of the program headers"""
+        for i in range(self.phnum if self.phoff else 0):
+            ph = self.phdr.unpack_from(self.data, self.phoff + i * self.phentsize)
+            if self.elf64:
+                p_type, flags, offset, vaddr, paddr, filesz = ph[:6]
+            else:
+                p_type, offset, vaddr, paddr, filesz = ph[:5]
+            yield p_type, offset, vaddr, filesz
+
+    def sections(self):
+        """Return (type, offset, size, link, addralign) of the section
+        headers"""
+        sections = []
+        for i in range(self.shnum if self.shoff else 0):
+            sh = self.shdr.unpack_from(self.data, self.shoff + i * self.shentsize)
+            name, sh_type, flags, addr, offset, size, link, info, addralign = sh[:9]
+            sections.append((sh_type, offset, size, link, addralign))
+        return sections
+
+    def __file_offset(self, vaddr):
+        for p_type, offset, start, filesz in self.segments():
+            if p_type == PT_LOAD and start <= vaddr < start + filesz:
+                return offset + vaddr - start
+        raise ValueError("address %#x is not mapped" % vaddr)
+
+    def __string(self, strtab, index):
+        start = strtab + index
+        end = self.data.find(b"\0", start)
+        if end < 0:
+            raise ValueError("unterminated string")
+        return os.fsdecode(self.data[start:end])
+
+    def dynamic(self, sections):
+        """Return the (tag, value) entries of the dynamic section and the
+        file offset of the dynamic string table"""
+        strtab = None
+        for sh_type, offset, size, link, addralign in sections:
+            if sh_type == SHT_DYNAMIC:
+                strtab = sections[link][1]
+                break
+        else:
+            for p_type, offset, vaddr, size in self.segments():
+                if p_type == PT_DYNAMIC:
+                    break
+            else:
+                return [], None
+
+        entries = []
+        for i in range(size // self.dyn.size):
+            tag, value = self.dyn.unpack_from(self.data, offset + i * self.dyn.size)
+            if tag == DT_NULL:
+                break
+            if tag == DT_STRTAB and strtab is None:
+                strtab = self.__file_offset(value)
+            entries.append((tag, value))
+        return entries, strtab
+
+    def notes(self, sections):
+        """Yield (name, type, desc) of the notes"""
+        areas = [
+            (offset, size, 8 if addralign == 8 else 4)
+            for sh_type, offset, size, link, addralign in sections
+            if sh_type == SHT_NOTE
+        ]
+        if not sections:
+            areas = [
+                (offset, size, 4)
+                for p_type, offset, vaddr, size in self.segments()
+                if p_type == PT_NOTE
+            ]
+
+        for offset, size, align in areas:
+            end = offset + size
+            while offset + self.note.size <= end:
+                namesz, descsz, n_type = self.note.unpack_from(self.data, offset)
+                offset += self.note.size
+                name = self.data[offset : offset + namesz].rstrip(b"\0")
+                offset += (namesz + align - 1) & ~(align - 1)
+                desc = self.data[offset : offset + descsz]
+                offset += (descsz + align - 1) & ~(align - 1)
+                yield name, n_type, desc
+
+    def info(self):
+        sections = self.sections()
+
+        soname = rpath = runpath = None
+        needed = []
+        entries, strtab = self.dynamic(sections)
+        for tag, value in entries:
+            if tag == DT_NEEDED:
+                needed.append(self.__string(strtab, value))
+            elif tag == DT_SONAME:
+                soname = self.__string(strtab, value)
+            elif tag == DT_RPATH:
+                rpath = self.__string(strtab, value)
+            elif tag == DT_RUNPATH:
+                runpath = self.__string(strtab, value)
+
+        build_id = None
+        for name, n_type, desc in self.notes(sections):
+            if name == b"GNU" and n_type == NT_GNU_BUILD_ID:
+                build_id = desc.hex()
+                break
+
+        return ElfInfo(soname, needed, rpath, runpath, build_id)
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return _Reader(data).info()
+
+
+def read(path):
+    """Return the ElfInfo of the ELF object at path, or None if it can not
+    be read or is not an ELF object"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    key = (st.st_ino, st.st_mtime_ns)
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    try:
+        info = _read(path)
+    except (OSError, ValueError, IndexError, struct.error):
+        info = None
+    _cache[path] = (key, info)
+    return info
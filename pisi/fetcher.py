@@ -9,9 +9,13 @@ knows what."""
 # python standard library modules
 import base64
 import contextlib
+import hashlib
 import os
 import shutil
+import ssl
+import threading
 import time
+import http.client
 import urllib.request, urllib.error, urllib.parse
 
 from pisi import translate as _
@@ -27,9 +31,208 @@ class FetchError(pisi.Error):
     pass
 
 
+# size of the blocks read from the network and written to disk
+FETCH_BLOCK_SIZE = 128 * 1024
+
+
+class PooledResponse:
+    """HTTP response borrowed from a ConnectionPool. The connection goes
+    back to the pool on close() if the whole body has been read."""
+
+    def __init__(self, pool, key, conn, response):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.status = response.status
+
+    def info(self):
+        return self.response.msg
+
+    def read(self, amt=None):
+        return self.response.read(amt)
+
+    def readinto(self, buffer):
+        return self.response.readinto(buffer)
+
+    def close(self):
+        if self.conn is None:
+            return
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.release(self.key, self.conn)
+        else:
+            self.response.close()
+            self.conn.close()
+        self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections shared by every Fetcher of the
+    process, so that fetching the index and all the packages of a
+    transaction from the same mirror only needs a single connection per
+    download worker.
+
+    Idle connections are kept per (scheme, server, proxy). The pool also
+    remembers whether a server answered ranged requests, resuming a
+    partial download then does not need an extra probing request."""
+
+    max_redirects = 5
+    max_idle = 8
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.range_support = {}
+        self.ssl_context = None
+
+    def __get_ssl_context(self):
+        with self.lock:
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            return self.ssl_context
+
+    def __connect(self, key, timeout):
+        scheme, netloc, proxy = key
+        target = urllib.parse.urlsplit("%s://%s" % (scheme, netloc))
+        headers = {}
+
+        if proxy:
+            proxy = urllib.parse.urlsplit(proxy)
+            host, port = proxy.hostname, proxy.port
+            if proxy.username:
+                credentials = "%s:%s" % (
+                    urllib.parse.unquote(proxy.username),
+                    urllib.parse.unquote(proxy.password or ""),
+                )
+                headers["Proxy-Authorization"] = (
+                    "Basic %s" % base64.b64encode(credentials.encode()).decode()
+                )
+        else:
+            host, port = target.hostname, target.port
+
+        ctx.ui.debug(_("Opening connection to %s") % (proxy or target).netloc)
+
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(
+                host, port, timeout=timeout, context=self.__get_ssl_context()
+            )
+            if proxy:
+                conn.set_tunnel(target.hostname, target.port, headers)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=timeout)
+
+        # headers sent with every request, plain HTTP requests go through
+        # the proxy with absolute URLs
+        conn.extra_headers = headers if proxy and scheme == "http" else {}
+        return conn
+
+    def __acquire(self, key):
+        with self.lock:
+            connections = self.idle.get(key)
+            if connections:
+                return connections.pop()
+        return None
+
+    def release(self, key, conn):
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.max_idle:
+                connections.append(conn)
+                return
+        conn.close()
+
+    def __request(self, key, path, headers, timeout):
+        conn = self.__acquire(key)
+        if conn is not None:
+            try:
+                conn.request("GET", path, headers=dict(headers, **conn.extra_headers))
+                return conn, conn.getresponse()
+            except (http.client.HTTPException, OSError):
+                # the server has closed the idle connection in the meantime
+                conn.close()
+
+        conn = self.__connect(key, timeout)
+        try:
+            conn.request("GET", path, headers=dict(headers, **conn.extra_headers))
+            return conn, conn.getresponse()
+        except BaseException:
+            conn.close()
+            raise
+
+    def open(self, url, headers, proxies, timeout=15):
+        """Send a GET request for url and return a PooledResponse.
+        Redirects are followed, HTTP errors are raised as
+        urllib.error.HTTPError like urllib does."""
+        for redirect in range(self.max_redirects + 1):
+            parts = urllib.parse.urlsplit(url)
+            if parts.scheme not in ("http", "https"):
+                raise urllib.error.URLError(
+                    _("Unsupported redirection to %s") % url
+                )
+
+            proxy = proxies.get(parts.scheme)
+            key = (parts.scheme, parts.netloc, proxy)
+            if proxy and parts.scheme == "http":
+                path = urllib.parse.urlunsplit(parts._replace(fragment=""))
+            else:
+                path = urllib.parse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+
+            conn, response = self.__request(key, path, headers, timeout)
+            pooled = PooledResponse(self, key, conn, response)
+
+            if response.status in (301, 302, 303, 307, 308):
+                location = response.getheader("Location")
+                # drain the body to be able to reuse the connection
+                response.read()
+                pooled.close()
+                if not location:
+                    break
+                url = urllib.parse.urljoin(url, location)
+                continue
+
+            if response.status >= 400:
+                msg = response.msg
+                response.read()
+                pooled.close()
+                raise urllib.error.HTTPError(
+                    url, response.status, response.reason, msg, None
+                )
+
+            return pooled
+
+        raise urllib.error.URLError(_("Too many redirections for %s") % url)
+
+    def get_range_support(self, url):
+        """Return True or False if the server of url is known to support
+        ranged requests, None if it has not been asked yet."""
+        with self.lock:
+            return self.range_support.get((url.scheme(), url.location()))
+
+    def set_range_support(self, url, supported):
+        with self.lock:
+            self.range_support[(url.scheme(), url.location())] = supported
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+
+connection_pool = ConnectionPool()
+
+
 class FetchHandler:
-    def __init__(self, url, archive, bandwidth_limit, start_time):
+    def __init__(self, url, archive, bandwidth_limit, start_time, show_progress=True):
         self.url = url
+        self.show_progress = show_progress
         self.percent = None
         self.rate = 0.0
         self.size = 0
@@ -49,9 +252,9 @@ class FetchHandler:
 
         self.s_time = self.now()
 
-    def update(self, blocknum, bs, size):
+    def update(self, downloaded, size):
         self.total_size = size + self.exist_size
-        self.size = blocknum * bs + self.exist_size
+        self.size = downloaded + self.exist_size
         if self.total_size:
             self.percent = self.size * 100.0 / self.total_size
             if self.percent > 100:
@@ -76,7 +279,8 @@ class FetchHandler:
                     ]
                 )
 
-        self._update_ui()
+        if self.show_progress:
+            self._update_ui()
         self._limit_bandwidth()
 
     def _limit_bandwidth(self):
@@ -113,6 +317,8 @@ class Fetcher:
         self.destdir = destdir
         self.destfile = destfile
         self.progress = None
+        # SHA1 sum of the fetched file, computed while downloading
+        self.sha1sum = None
 
         self.archive_file = os.path.join(destdir, destfile or url.filename())
         self.partial_file = (
@@ -153,49 +359,36 @@ class Fetcher:
                     self.partial_file,
                     self._get_bandwidth_limit(),
                     self.start_time,
+                    self.progress is not None,
                 )
 
+                if self.url.scheme() in ("http", "https"):
+                    self._fetch_http(fetch_handler)
+                    success = True
+                    continue
+
+                # Use a private opener instead of installing a global one,
+                # several Fetchers may run at the same time.
                 proxy = urllib.request.ProxyHandler(self._get_proxies())
                 opener = urllib.request.build_opener(proxy)
                 opener.addheaders = self._get_headers()
-                urllib.request.install_opener(opener)
-                has_range_support = self._test_range_support()
+                has_range_support = self._test_range_support(opener)
 
                 if has_range_support and os.path.exists(self.partial_file):
                     partial_file_size = os.path.getsize(self.partial_file)
                     opener.addheaders.append(("Range", "bytes=%s-" % partial_file_size))
+                else:
+                    fetch_handler.exist_size = 0
 
                 with contextlib.closing(
-                    urllib.request.urlopen(self.url.get_uri(), timeout=15)
+                    opener.open(self.url.get_uri(), timeout=15)
                 ) as fp:
-                    headers = fp.info()
-
                     if self.url.is_local_file():
                         return os.path.normpath(self.url.path())
 
-                    if has_range_support:
-                        tfp = open(self.partial_file, "ab")
-                    else:
-                        tfp = open(self.partial_file, "wb")
-
-                    with tfp:
-                        bs = 1024 * 8
-                        size = -1
-                        read = 0
-                        blocknum = 0
-                        if "content-length" in headers:
-                            size = int(headers["Content-Length"])
-                        fetch_handler.update(blocknum, bs, size)
-                        while True:
-                            block = fp.read(bs)
-                            if not block:
-                                break
-                            read += len(block)
-                            tfp.write(block)
-                            blocknum += 1
-                            fetch_handler.update(blocknum, bs, size)
+                    self._download(fp, fetch_handler, has_range_support)
                     success = True
-            except IOError as e:
+            except (IOError, http.client.HTTPException) as e:
                 attempt += 1
                 if attempt == self._get_retry_attempts() + 1:
                     raise FetchError(
@@ -220,6 +413,85 @@ class Fetcher:
 
         return self.archive_file
 
+    def _fetch_http(self, fetch_handler):
+        """Fetch over a pooled keep-alive connection. A partial file is
+        resumed with a ranged request straight away, the answer tells
+        whether the server supports them."""
+        headers = dict(self._get_headers())
+        resume = os.path.exists(self.partial_file)
+
+        if resume and connection_pool.get_range_support(self.url) is False:
+            self._discard_partial()
+            resume = False
+
+        if resume:
+            headers["Range"] = "bytes=%d-" % os.path.getsize(self.partial_file)
+        else:
+            fetch_handler.exist_size = 0
+
+        try:
+            fp = connection_pool.open(self.url.get_uri(), headers, self._get_proxies())
+        except urllib.error.HTTPError as e:
+            if resume and e.code == 416:
+                # the partial file is complete or bogus, start over on retry
+                os.remove(self.partial_file)
+            raise
+
+        with fp:
+            if resume:
+                connection_pool.set_range_support(self.url, fp.status == 206)
+                if fp.status != 206:
+                    # the whole file is being sent again
+                    self._discard_partial()
+                    fetch_handler.exist_size = 0
+                    resume = False
+
+            self._download(fp, fetch_handler, resume)
+
+    def _discard_partial(self):
+        ctx.ui.debug(
+            _(
+                "Server doesn't support partial downloads. Previously downloaded part of the file will be over-written."
+            )
+        )
+        if os.path.exists(self.partial_file):
+            os.remove(self.partial_file)
+
+    def _download(self, fp, fetch_handler, resume):
+        headers = fp.info()
+
+        sha1 = hashlib.sha1()
+        if resume:
+            # resuming, the hash has to cover the part we already have
+            with open(self.partial_file, "rb") as partial:
+                for block in iter(lambda: partial.read(FETCH_BLOCK_SIZE), b""):
+                    sha1.update(block)
+            tfp = open(self.partial_file, "ab")
+        else:
+            tfp = open(self.partial_file, "wb")
+
+        # read at most a second worth of data at once when the bandwidth
+        # is limited, to keep the rate smooth
+        bs = FETCH_BLOCK_SIZE
+        if fetch_handler.bandwidth_limit:
+            bs = max(1024, min(bs, fetch_handler.bandwidth_limit))
+
+        with tfp:
+            size = -1
+            read = 0
+            if "content-length" in headers:
+                size = int(headers["Content-Length"])
+            fetch_handler.update(read, size)
+            while True:
+                block = fp.read(bs)
+                if not block:
+                    break
+                read += len(block)
+                tfp.write(block)
+                sha1.update(block)
+                fetch_handler.update(read, size)
+        self.sha1sum = sha1.hexdigest()
+
     def _get_headers(self):
         headers = []
         headers.append(("User-Agent", "eopkg Fetcher/" + pisi.__version__))
@@ -272,14 +544,12 @@ class Fetcher:
         else:
             return 5
 
-    def _test_range_support(self):
+    def _test_range_support(self, opener):
         if not os.path.exists(self.partial_file):
             return False
 
         try:
-            file_obj = urllib.request.urlopen(
-                urllib.request.Request(self.url.get_uri())
-            )
+            file_obj = opener.open(urllib.request.Request(self.url.get_uri()))
         except urllib.error.URLError:
             ctx.ui.debug(
                 _(
@@ -308,3 +578,30 @@ def fetch_url(url, destdir, progress=None, destfile=None):
     fetch = Fetcher(url, destdir, destfile)
     fetch.progress = progress
     fetch.fetch()
+
+
+def read_url(url):
+    """Return the contents of a small file at url. Unlike fetch_url,
+    failures are not retried and nothing is written to disk."""
+    if not isinstance(url, pisi.uri.URI):
+        url = pisi.uri.URI(url)
+
+    try:
+        if url.is_local_file():
+            with open(url.path(), "rb") as f:
+                return f.read()
+
+        fetch = Fetcher(url)
+        if url.scheme() in ("http", "https"):
+            with connection_pool.open(
+                url.get_uri(), dict(fetch._get_headers()), fetch._get_proxies()
+            ) as fp:
+                return fp.read()
+
+        proxy = urllib.request.ProxyHandler(fetch._get_proxies())
+        opener = urllib.request.build_opener(proxy)
+        opener.addheaders = fetch._get_headers()
+        with contextlib.closing(opener.open(url.get_uri(), timeout=15)) as fp:
+            return fp.read()
+    except (IOError, http.client.HTTPException) as e:
+        raise FetchError(_('Could not read "%s": %s') % (url.get_uri(), e))
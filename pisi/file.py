@@ -88,12 +88,18 @@ class File:
     def decompress(localfile, compress):
         compress = File.choose_method(localfile, compress)
         if compress == File.COMPRESSION_TYPE_XZ:
-            open(localfile[:-3], "wb").write(lzma.LZMAFile(localfile).read())
-            localfile = localfile[:-3]
+            target = localfile[:-3]
+            source = lzma.LZMAFile(localfile)
         elif compress == File.COMPRESSION_TYPE_BZ2:
-            open(localfile[:-4], "w").write(bz2.BZ2File(localfile).read())
-            localfile = localfile[:-4]
-        return localfile
+            target = localfile[:-4]
+            source = bz2.BZ2File(localfile)
+        else:
+            return localfile
+
+        # stream, indexes can be much bigger than their compressed files
+        with source, open(target, "wb") as f:
+            shutil.copyfileobj(source, f, 256 * 1024)
+        return target
 
     @staticmethod
     def download(
@@ -2,12 +2,19 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 
 # the most simple minded digraph class ever
+#
+# Vertices are numbered in the order they are added and all traversals run
+# on those numbers, iteratively, so deep dependency chains do not run into
+# the recursion limit.
 
 
 import pisi
 
 from pisi import translate as _
 
+# dfs colors
+WHITE, GRAY, BLACK = list(range(3))
+
 
 class CycleException(pisi.Exception):
     def __init__(self, cycle):
@@ -19,100 +26,99 @@ class CycleException(pisi.Exception):
 
 class Digraph(object):
     def __init__(self):
-        self.__v = set()
-        self.__adj = {}
-        self.__vdata = {}
-        self.__edata = {}
+        self.__ids = {}  # vertex -> id
+        self.__v = []  # id -> vertex
+        self.__adj = []  # id -> {successor id: edge data}, in insertion order
+        self.__vdata = {}  # id -> vertex data
 
     def vertices(self):
-        "return set of vertex descriptors"
-        return self.__v
+        "return a set-like view of the vertex descriptors"
+        return self.__ids.keys()
 
     def edges(self):
         "return a list of edge descriptors"
         l = []
-        for u in self.__v:
-            for v in self.__adj[u]:
-                l.append((u, v))
+        for u, adj in enumerate(self.__adj):
+            for v in adj:
+                l.append((self.__v[u], self.__v[v]))
         return l
 
     def add_vertex(self, u, data=None):
         "add vertex u, optionally with data"
-        assert not u in self.__v
-        self.__v.add(u)
-        self.__adj[u] = set()
+        assert not u in self.__ids
+        self.__ids[u] = len(self.__v)
+        self.__v.append(u)
+        self.__adj.append({})
         if data:
-            self.__vdata[u] = data
-            self.__edata[u] = {}
+            self.__vdata[self.__ids[u]] = data
 
     def add_edge(self, u, v, edata=None, udata=None, vdata=None):
         "add edge u -> v"
-        if not u in self.__v:
+        if not u in self.__ids:
             self.add_vertex(u, udata)
-        if not v in self.__v:
+        if not v in self.__ids:
             self.add_vertex(v, vdata)
-        self.__adj[u].add(v)
-        if edata != None:
-            self.__edata[u][v] = edata
+        adj = self.__adj[self.__ids[u]]
+        v = self.__ids[v]
+        if edata is not None or v not in adj:
+            adj[v] = edata
 
     def add_biedge(self, u, v, edata=None):
         self.add_edge(u, v, edata)
         self.add_edge(v, u, edata)
 
     def set_vertex_data(self, u, data):
-        self.__vdata[u] = data
+        self.__vdata[self.__ids[u]] = data
 
     def vertex_data(self, u):
-        return self.__vdata[u]
+        return self.__vdata[self.__ids[u]]
 
     def edge_data(self, u, v):
-        return self.__edata[u][v]
+        return self.__adj[self.__ids[u]][self.__ids[v]]
 
     def has_vertex(self, u):
-        return u in self.__v
+        return u in self.__ids
 
     def has_edge(self, u, v):
-        if u in self.__v:
-            return v in self.__adj[u]
+        if u in self.__ids and v in self.__ids:
+            return self.__ids[v] in self.__adj[self.__ids[u]]
         else:
             return False
 
     def adj(self, u):
-        return self.__adj[u]
+        return [self.__v[v] for v in self.__adj[self.__ids[u]]]
 
     def dfs(self, finish_hook=None):
-        self.color = {}
-        self.p = {}
-        self.d = {}
-        self.f = {}
-        for u in self.__v:
-            self.color[u] = "w"  # mark white (unexplored)
-            self.p[u] = None
-        self.time = 0
-        for u in self.__v:
-            if self.color[u] == "w":
-                self.dfs_visit(u, finish_hook)
-
-    def dfs_visit(self, u, finish_hook):
-        self.color[u] = "g"  # mark green (discovered)
-        self.d[u] = self.time = self.time + 1
-        for v in self.adj(u):
-            if self.color[v] == "w":  # explore unexplored vertices
-                self.p[v] = u
-                self.dfs_visit(v, finish_hook)
-            elif self.color[v] == "g":  # cycle detected
-                cycle = [u]
-                while self.p[u]:
-                    u = self.p[u]
-                    cycle.append(u)
-                    if self.has_edge(cycle[0], u):
-                        break
-                cycle.reverse()
-                raise CycleException(cycle)
-        self.color[u] = "b"  # mark black (completed)
-        if finish_hook:
-            finish_hook(u)
-        self.f[u] = self.time = self.time + 1
+        """Depth first search from every vertex, in the order they have
+        been added. finish_hook is called with each vertex once all the
+        vertices it leads to are done. Raises CycleException, holding the
+        vertices of the cycle, on the first cycle found."""
+        color = bytearray(len(self.__v))
+        for root in range(len(self.__v)):
+            if color[root] == WHITE:
+                self.__dfs_visit(root, color, finish_hook)
+
+    def __dfs_visit(self, root, color, finish_hook):
+        adj = self.__adj
+        color[root] = GRAY
+        path = [root]
+        successors = [iter(adj[root])]
+        while path:
+            for v in successors[-1]:
+                if color[v] == WHITE:  # explore unexplored vertices
+                    color[v] = GRAY
+                    path.append(v)
+                    successors.append(iter(adj[v]))
+                    break
+                elif color[v] == GRAY:  # cycle detected
+                    cycle = path[path.index(v) :]
+                    raise CycleException([self.__v[x] for x in cycle])
+            else:
+                u = path.pop()
+                successors.pop()
+                color[u] = BLACK  # mark black (completed)
+                if finish_hook:
+                    finish_hook(self.__v[u])
 
     def cycle_free(self):
         try:
@@ -127,6 +133,83 @@ class Digraph(object):
         list.reverse()
         return list
 
+    def strongly_connected_components(self):
+        """Return the strongly connected components as lists of vertices.
+        A component comes after all the components it has edges to."""
+        adj = self.__adj
+        index = [-1] * len(self.__v)
+        low = [0] * len(self.__v)
+        on_stack = bytearray(len(self.__v))
+        stack = []
+        components = []
+        counter = 0
+
+        for root in range(len(self.__v)):
+            if index[root] >= 0:
+                continue
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            path = [(root, iter(adj[root]))]
+            while path:
+                u, successors = path[-1]
+                for v in successors:
+                    if index[v] < 0:
+                        index[v] = low[v] = counter
+                        counter += 1
+                        stack.append(v)
+                        on_stack[v] = True
+                        path.append((v, iter(adj[v])))
+                        break
+                    elif on_stack[v]:
+                        low[u] = min(low[u], index[v])
+                else:
+                    path.pop()
+                    if path:
+                        parent = path[-1][0]
+                        low[parent] = min(low[parent], low[u])
+                    if low[u] == index[u]:
+                        component = []
+                        while True:
+                            v = stack.pop()
+                            on_stack[v] = False
+                            component.append(self.__v[v])
+                            if v == u:
+                                break
+                        components.append(component)
+        return components
+
+    def cycles(self):
+        "return the strongly connected components which hold a cycle"
+        return [
+            c
+            for c in self.strongly_connected_components()
+            if len(c) > 1 or self.has_edge(c[0], c[0])
+        ]
+
+    def reverse_closure(self, vertices):
+        """Return the vertices from which one of vertices can be reached,
+        vertices included, closest ones first"""
+        predecessors = [[] for u in self.__v]
+        for u, adj in enumerate(self.__adj):
+            for v in adj:
+                predecessors[v].append(u)
+
+        seen = bytearray(len(self.__v))
+        closure = []
+        for u in vertices:
+            u = self.__ids[u]
+            if not seen[u]:
+                seen[u] = True
+                closure.append(u)
+        for u in closure:
+            for v in predecessors[u]:
+                if not seen[v]:
+                    seen[v] = True
+                    closure.append(v)
+        return [self.__v[u] for u in closure]
+
     def id_str(self, u):
         # Graph format only accepts underscores as key values
         # Sanitize the values. This is 2x faster than the old method.
@@ -17,6 +17,7 @@ import pisi.util as util
 import pisi.package
 import pisi.pxml.xmlfile as xmlfile
 import pisi.file
+import pisi.indexdelta
 import pisi.pxml.autoxml as autoxml
 import pisi.component as component
 import pisi.group as group
@@ -66,6 +67,9 @@ class Index(xmlfile.XmlFile, metaclass=autoxml.autoxml):
 
         doc = self.read_uri(uri, tmpdir, force)
 
+        # the whole index has been fetched, see pisi.indexdelta
+        pisi.indexdelta.clear_generation(tmpdir, uri)
+
         if not repo:
             repo = self.distribution.name()
             # and what do we do with it? move it to index dir properly
@@ -0,0 +1,407 @@
+# SPDX-FileCopyrightText: 2024 Solus Project
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Incremental repository index updates.
+
+When asked to, "eopkg index" keeps the previous index around long enough
+to write an index delta next to the new one. A delta lists the Package
+nodes which have been added or changed, the names of removed packages
+and, rarely, the other top level sections (Distribution, Component,
+Group, SpecFile) when they have changed at all.
+
+Index generations are identified by the SHA1 sum of the uncompressed
+index. The deltas of the last few generations are listed in a manifest,
+eopkg-index.xml.deltas, one "<from> <to> <file> <sha1sum>" line each.
+
+update-repo follows the manifest from the local generation to the
+latest one, downloads only those deltas, patches the local index and the
+PackageDB/ComponentDB caches in place. Whenever that is not possible it
+falls back to downloading the whole index.
+"""
+
+import lzma
+import os
+from xml.sax.saxutils import escape
+
+import iksemel
+
+from pisi import translate as _
+
+import pisi
+import pisi.context as ctx
+import pisi.fetcher
+import pisi.uri
+import pisi.util as util
+from pisi.file import File
+
+# top level index sections replaced as a whole when they change
+INDEX_SECTIONS = ("Distribution", "SpecFile", "Component", "Group")
+# sections the index holds in front of the Package nodes, reading only the
+# header of an index stops at the first Package
+HEADER_SECTIONS = ("Distribution", "SpecFile")
+
+
+class Error(pisi.Error):
+    pass
+
+
+class IndexSnapshot:
+    """Serialized top level nodes of an index file"""
+
+    def __init__(self, path):
+        self.generation = util.sha1_file(path)
+        self.packages = {}
+        self.sections = dict((tag, []) for tag in INDEX_SECTIONS)
+
+        doc = iksemel.parse(path)
+        for node in doc.tags():
+            if node.name() == "Package":
+                self.packages[node.getTagData("Name")] = node.toString()
+            elif node.name() in self.sections:
+                self.sections[node.name()].append(node.toString())
+
+
+class IndexDelta:
+    """Changes between two index generations"""
+
+    def __init__(self, source, target):
+        self.source = source
+        self.target = target
+        self.packages = {}  # name -> Package node XML
+        self.removed = []
+        self.sections = {}  # tag -> list of node XML, only for changed sections
+
+    @staticmethod
+    def compute(old, new):
+        delta = IndexDelta(old.generation, new.generation)
+        for name, xml in new.packages.items():
+            if old.packages.get(name) != xml:
+                delta.packages[name] = xml
+        delta.removed = sorted(set(old.packages) - set(new.packages))
+        for tag in INDEX_SECTIONS:
+            if old.sections[tag] != new.sections[tag]:
+                delta.sections[tag] = new.sections[tag]
+        return delta
+
+    @staticmethod
+    def parse(data):
+        doc = iksemel.parseString(data)
+        info = doc.getTag("IndexDelta")
+        if info is None:
+            raise Error(_("Index delta is malformed."))
+
+        delta = IndexDelta(info.getTagData("From"), info.getTagData("To"))
+        removed = info.getTag("Removed")
+        if removed:
+            delta.removed = [x.firstChild().data() for x in removed.tags("Name")]
+        for tag in info.tags("Updated"):
+            delta.sections[tag.firstChild().data()] = []
+
+        for node in doc.tags():
+            if node.name() == "Package":
+                delta.packages[node.getTagData("Name")] = node.toString()
+            elif node.name() in delta.sections:
+                delta.sections[node.name()].append(node.toString())
+        return delta
+
+    def toString(self):
+        xml = ["<PISI>", "<IndexDelta>"]
+        xml.append("<From>%s</From>" % self.source)
+        xml.append("<To>%s</To>" % self.target)
+        if self.removed:
+            xml.append("<Removed>")
+            xml.extend("<Name>%s</Name>" % escape(name) for name in self.removed)
+            xml.append("</Removed>")
+        xml.extend("<Updated>%s</Updated>" % tag for tag in self.sections)
+        xml.append("</IndexDelta>")
+        for nodes in self.sections.values():
+            xml.extend(nodes)
+        xml.extend(self.packages.values())
+        xml.append("</PISI>")
+        return "\n".join(xml)
+
+    def has_packages_only(self):
+        """True if only Package nodes are affected, the caches can then be
+        patched instead of regenerated"""
+        return not self.sections
+
+    def apply(self, doc):
+        """Patch the iksemel document of the previous index generation,
+        returns the patched document"""
+        replaced = set(self.removed).union(self.packages)
+        if any(tag in self.sections for tag in HEADER_SECTIONS):
+            return self.__rebuild(doc, replaced)
+
+        for node in list(doc.tags()):
+            if node.name() == "Package":
+                if node.getTagData("Name") in replaced:
+                    node.hide()
+            elif node.name() in self.sections:
+                node.hide()
+
+        for nodes in self.sections.values():
+            for xml in nodes:
+                doc.insertNode(iksemel.parseString(xml))
+        for xml in self.packages.values():
+            doc.insertNode(iksemel.parseString(xml))
+        return doc
+
+    def __rebuild(self, doc, replaced):
+        # iksemel can only append nodes, so the document is written again
+        # in index order to put the changed header sections in front
+        sections = dict((tag, []) for tag in INDEX_SECTIONS)
+        packages = []
+        for node in doc.tags():
+            if node.name() == "Package":
+                if node.getTagData("Name") not in replaced:
+                    packages.append(node.toString())
+            elif node.name() in sections and node.name() not in self.sections:
+                sections[node.name()].append(node.toString())
+        sections.update(self.sections)
+        packages.extend(self.packages.values())
+
+        new_doc = iksemel.newDocument(doc.name())
+        for tag in HEADER_SECTIONS:
+            for xml in sections.pop(tag):
+                new_doc.insertNode(iksemel.parseString(xml))
+        for xml in packages:
+            new_doc.insertNode(iksemel.parseString(xml))
+        for tag in INDEX_SECTIONS:
+            for xml in sections.get(tag, []):
+                new_doc.insertNode(iksemel.parseString(xml))
+        return new_doc
+
+
+def manifest_path(index_path):
+    return index_path + ctx.const.index_deltas_suffix
+
+
+def parse_manifest(data):
+    """Return the (from, to, file name, sha1sum) entries of a manifest"""
+    entries = []
+    for line in data.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        fields = line.split()
+        if len(fields) != 4:
+            raise Error(_("Index delta manifest is malformed."))
+        entries.append(tuple(fields))
+    return entries
+
+
+def write_deltas(index_path, old, keep):
+    """Write the delta from the old IndexSnapshot to the index just written
+    at index_path and keep the deltas of the last keep generations"""
+    new = IndexSnapshot(index_path)
+    index_dir = os.path.dirname(os.path.abspath(index_path))
+    manifest = manifest_path(index_path)
+
+    entries = []
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            entries = parse_manifest(f.read())
+
+    if old is not None and old.generation != new.generation:
+        delta = IndexDelta.compute(old, new)
+        # a generation may be seen again, name deltas after both ends
+        filename = "%s.%s-%s.delta%s" % (
+            os.path.basename(index_path),
+            old.generation,
+            new.generation,
+            ctx.const.xz_suffix,
+        )
+        delta_path = os.path.join(index_dir, filename)
+        with lzma.open(delta_path, "wb") as f:
+            f.write(delta.toString().encode())
+        entries.append(
+            (old.generation, new.generation, filename, util.sha1_file(delta_path))
+        )
+        ctx.ui.info(
+            _("Index delta written: %d packages changed, %d removed")
+            % (len(delta.packages), len(delta.removed))
+        )
+
+    # drop the deltas of old generations
+    kept = set(entry[2] for entry in entries[-keep:])
+    for entry in entries[:-keep]:
+        if entry[2] in kept:
+            continue
+        try:
+            os.unlink(os.path.join(index_dir, entry[2]))
+        except OSError:
+            pass
+    entries = entries[-keep:]
+
+    tmp_path = "%s%s" % (manifest, ctx.const.temporary_suffix)
+    with open(tmp_path, "w") as f:
+        f.write("# eopkg index deltas: <from> <to> <file> <sha1sum>\n")
+        for entry in entries:
+            f.write("%s\n" % " ".join(entry))
+    os.rename(tmp_path, manifest)
+
+
+def remove_deltas(index_path):
+    """Remove the manifest and the deltas kept next to the index at
+    index_path, once it is published without deltas"""
+    manifest = manifest_path(index_path)
+    if not os.path.exists(manifest):
+        return
+
+    index_dir = os.path.dirname(os.path.abspath(index_path))
+    with open(manifest) as f:
+        try:
+            entries = parse_manifest(f.read())
+        except Error:
+            entries = []
+    os.unlink(manifest)
+    for entry in entries:
+        try:
+            os.unlink(os.path.join(index_dir, entry[2]))
+        except OSError:
+            pass
+    ctx.ui.info(_("Index deltas removed"))
+
+
+def __remote_index(uri):
+    if File.is_compressed(uri):
+        uri = os.path.splitext(uri)[0]
+    return uri
+
+
+def __local_index(repo, uri):
+    # see RepoDB.get_repo_index_path
+    index = os.path.basename(__remote_index(uri))
+    return util.join_path(ctx.config.index_dir(), repo, index)
+
+
+def __generation_file(index_path):
+    return index_path + ctx.const.index_generation_suffix
+
+
+def current_generation(index_path):
+    """Return the generation of the local index at index_path"""
+    try:
+        with open(__generation_file(index_path)) as f:
+            return f.read().strip()
+    except IOError:
+        # the index has been fetched as a whole
+        return util.sha1_file(index_path)
+
+
+def clear_generation(transfer_dir, uri):
+    """Forget the generation recorded by update_repo after the whole index
+    at uri has been fetched to transfer_dir"""
+    index = os.path.basename(__remote_index(uri))
+    try:
+        os.unlink(__generation_file(util.join_path(transfer_dir, index)))
+    except OSError:
+        pass
+
+
+def __find_chain(entries, generation):
+    by_source = dict((entry[0], entry) for entry in entries)
+    chain = []
+    while generation != entries[-1][1]:
+        entry = by_source.get(generation)
+        if entry is None or len(chain) == len(entries):
+            return None
+        chain.append(entry)
+        generation = entry[1]
+    return chain
+
+
+def update_repo(repo, uri):
+    """Bring the local index of repo up to date with index deltas.
+
+    Returns the list of applied IndexDeltas, empty if the index was up to
+    date, or None if deltas can not be used and the whole index has to be
+    fetched."""
+    if not pisi.uri.URI(uri).is_remote_file():
+        return None
+
+    index_path = __local_index(repo, uri)
+    if not os.path.exists(index_path):
+        return None
+
+    remote_index = __remote_index(uri)
+    try:
+        entries = parse_manifest(
+            pisi.fetcher.read_url(manifest_path(remote_index)).decode()
+        )
+    except (pisi.fetcher.FetchError, Error, UnicodeDecodeError) as e:
+        ctx.ui.debug("Index deltas are not available for %s: %s" % (repo, e))
+        return None
+
+    if not entries:
+        return None
+
+    # the manifest goes stale when the index is published without deltas,
+    # so its last generation has to be the checksum of the published index
+    try:
+        published = pisi.fetcher.read_url(remote_index + ".sha1sum")
+        published = published.decode().split()
+    except (pisi.fetcher.FetchError, UnicodeDecodeError) as e:
+        ctx.ui.debug("Could not read the %s index checksum: %s" % (repo, e))
+        return None
+    if not published or published[0] != entries[-1][1]:
+        ctx.ui.debug("Index delta manifest of %s is out of date" % repo)
+        return None
+
+    chain = __find_chain(entries, current_generation(index_path))
+    if chain is None:
+        ctx.ui.debug("No index delta chain to the latest %s index" % repo)
+        return None
+    if not chain:
+        return []
+
+    transfer_dir = os.path.dirname(index_path)
+    base_uri = os.path.dirname(remote_index)
+    deltas = []
+    try:
+        for source, target, filename, sha1sum in chain:
+            ctx.ui.info(_("Fetching index delta %s") % filename, verbose=True)
+            fetch = pisi.fetcher.Fetcher(
+                "%s/%s" % (base_uri, filename), transfer_dir
+            )
+            fetch.progress = ctx.ui.Progress
+            path = fetch.fetch()
+            try:
+                if (fetch.sha1sum or util.sha1_file(path)) != sha1sum:
+                    raise Error(_("File integrity of %s compromised.") % filename)
+                with lzma.open(path) as f:
+                    delta = IndexDelta.parse(f.read().decode())
+            finally:
+                os.unlink(path)
+            if (delta.source, delta.target) != (source, target):
+                raise Error(_("Index delta %s does not match the manifest.") % filename)
+            deltas.append(delta)
+    except (pisi.fetcher.FetchError, Error, lzma.LZMAError) as e:
+        ctx.ui.warning(_("Could not use index deltas, fetching the whole index: %s") % e)
+        return None
+
+    doc = iksemel.parse(index_path)
+    for delta in deltas:
+        doc = delta.apply(doc)
+
+    tmp_path = "%s%s" % (index_path, ctx.const.temporary_suffix)
+    with open(tmp_path, "w") as f:
+        f.write(doc.toString())
+    os.rename(tmp_path, index_path)
+    with open(__generation_file(index_path), "w") as f:
+        f.write(deltas[-1].target)
+
+    # the compressed index no longer matches the local one
+    compressed = util.join_path(transfer_dir, os.path.basename(uri))
+    if compressed != index_path and os.path.exists(compressed):
+        os.unlink(compressed)
+
+    ctx.ui.info(
+        _("Applied %d index deltas: %d packages updated, %d removed.")
+        % (
+            len(deltas),
+            sum(len(d.packages) for d in deltas),
+            sum(len(d.removed) for d in deltas),
+        )
+    )
+    return deltas
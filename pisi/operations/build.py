@@ -4,6 +4,8 @@
 """package building code"""
 
 # python standard library
+import collections
+import concurrent.futures
 import os
 import re
 import glob
@@ -11,6 +13,8 @@ import stat
 import pwd
 import grp
 import fnmatch
+import threading
+import time
 
 from pisi import translate as _
 
@@ -29,6 +33,7 @@ import pisi.metadata
 import pisi.package
 import pisi.component as component
 import pisi.archive as archive
+import pisi.elf
 import pisi.actionsapi.variables
 import pisi.db
 
@@ -160,42 +165,55 @@ def get_debug_path(filepath, fileinfo, install_dir):
     ):
         return (None, None)
 
-    code, out, err = pisi.util.run_batch('LC_ALL=C readelf -n "%s"' % filepath)
-    if code != 0 or not out:
+    info = pisi.elf.read(filepath)
+    if info is None or not info.build_id:
         return (None, None)
-    for line in out.split("\n"):
-        if "Build ID:" not in line:
-            continue
-        val = line.split(":")[1].strip()
+    val = info.build_id
 
-        suffix = util.join_path(
-            ctx.const.debug_files_suffix, ".build-id", val[0:2], val[2:]
-        )
+    suffix = util.join_path(ctx.const.debug_files_suffix, ".build-id", val[0:2], val[2:])
 
-        path = util.join_path(
-            os.path.dirname(install_dir),
-            ctx.const.debug_dir_suffix,
-            ctx.const.debug_files_suffix,
-            ".build-id",
-            val[0:2],
-            val[2:],
-        )
+    path = util.join_path(
+        os.path.dirname(install_dir),
+        ctx.const.debug_dir_suffix,
+        ctx.const.debug_files_suffix,
+        ".build-id",
+        val[0:2],
+        val[2:],
+    )
+
+    return (path, suffix)
 
-        return (path, suffix)
+
+def get_strip_jobs():
+    jobs = ctx.get_option("strip_jobs") or ctx.config.values.build.strip_jobs
+    if jobs == "auto":
+        return os.cpu_count() or 1
+    try:
+        jobs = int(jobs)
+    except ValueError:
+        jobs = 1
+    return max(jobs, 1)
 
 
-def strip_debug_action(filepath, fileinfo, install_dir, ag):
+def strip_debug_action(filepath, fileinfo, install_dir, ag, debug_path=None):
+    """Strip filepath and split its debug info. debug_path is what
+    get_debug_path() returns for the file, it is looked up if not given.
+    Returns the debug_map entry of the file, a (path, debug path) tuple,
+    or None if the debug info is not stored under its BuildID.
+
+    This runs in the strip workers, so it leaves debug_map alone."""
     excludelist = tuple(ag.get("NoStrip", []))
-    global debug_map
 
     # real path in .pisi package
     path = "/" + util.removepathprefix(install_dir, filepath)
 
     if path.startswith(excludelist):
-        return
+        return None
 
-    outputpath, outclean = get_debug_path(filepath, fileinfo, install_dir)
-    buildID = None
+    if debug_path is None:
+        debug_path = get_debug_path(filepath, fileinfo, install_dir)
+    outputpath, outclean = debug_path
+    entry = None
 
     if outputpath is None:
         # Resort to old debug paths
@@ -210,12 +228,132 @@ def strip_debug_action(filepath, fileinfo, install_dir, ag):
         if clean[0] != "/":
             clean = "/%s" % clean
 
-        debug_map[clean] = outclean
-        buildID = True
+        entry = (clean, outclean)
     if util.strip_file(filepath, fileinfo, outputpath):
         ctx.ui.debug("%s [%s]" % (path, "stripped"))
-        if not buildID:
+        if entry is None:
             ctx.ui.warning("%s [%s]" % (path, "missing buildID"))
+    return entry
+
+
+def _get_debug_path(filepath, fileinfo, install_dir):
+    try:
+        return get_debug_path(filepath, fileinfo, install_dir)
+    except Exception:
+        return None
+
+
+def _strip_files(files, install_dir, ag):
+    """Strip files, (filepath, fileinfo, debug_path) tuples, one after the
+    other and return their debug_map entries"""
+    entries = []
+    for filepath, fileinfo, debug_path in files:
+        try:
+            entries.append(
+                strip_debug_action(filepath, fileinfo, install_dir, ag, debug_path)
+            )
+        except Exception:
+            entries.append(None)
+    return entries
+
+
+class FileTypes:
+    """libmagic descriptions of the files of a build, by path.
+
+    A file is only classified again once its stat signature changes, when
+    it is stripped for instance. Files which can not be classified are
+    described as None."""
+
+    def __init__(self):
+        self.types = {}  # path -> (stat signature, description)
+        self.local = threading.local()
+        self.classified = 0
+        self.lookups = 0
+
+    def __magic(self):
+        # every thread gets its own libmagic handle, a handle serializes
+        # the calls made through it
+        handle = getattr(self.local, "magic", None)
+        if handle is None:
+            handle = self.local.magic = magic.Magic()
+        return handle
+
+    def __classify(self, path):
+        """Return the description of the file at path and whether libmagic
+        had to be asked for it"""
+        try:
+            st = os.lstat(path)
+        except OSError:
+            self.types.pop(path, None)
+            return None, False
+
+        signature = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        entry = self.types.get(path)
+        if entry is not None and entry[0] == signature:
+            return entry[1], False
+
+        try:
+            description = self.__magic().from_file(path)
+        except Exception:
+            description = None
+        self.types[path] = (signature, description)
+        return description, True
+
+    def classify(self, paths, jobs):
+        """Classify the files at paths which are not known yet, or have
+        changed, with a pool of jobs workers"""
+        paths = [os.path.normpath(x) for x in paths]
+        if jobs == 1:
+            results = [self.__classify(x) for x in paths]
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+                results = list(executor.map(self.__classify, paths))
+        self.classified += sum(fresh for description, fresh in results)
+
+    def scan(self, directory, jobs):
+        """Classify all the files under directory"""
+        start = time.perf_counter()
+        classified = self.classified
+        paths = []
+        for root, dirs, files in os.walk(directory):
+            paths.extend(os.path.join(root, x) for x in files)
+        self.classify(paths, jobs)
+
+        ctx.ui.debug(
+            "Classified %d files under %s in %.3fs with %d jobs"
+            % (
+                self.classified - classified,
+                directory,
+                time.perf_counter() - start,
+                jobs,
+            )
+        )
+        counts = collections.Counter(self.kind(x[1]) for x in self.types.values())
+        for kind, count in sorted(counts.items(), key=lambda x: (-x[1], x[0])):
+            ctx.ui.debug("%6d %s" % (count, kind))
+
+    def get(self, path):
+        """Return the libmagic description of the file at path"""
+        self.lookups += 1
+        description, fresh = self.__classify(os.path.normpath(path))
+        self.classified += fresh
+        return description
+
+    @staticmethod
+    def kind(description):
+        """Short form of a description, to count files by"""
+        if description is None:
+            return "unknown"
+        if description.startswith("symbolic link"):
+            return "symbolic link"
+        return description.split(",", 1)[0]
+
+    def __str__(self):
+        return "%d files, %d lookups, %d classifications" % (
+            len(self.types),
+            self.lookups,
+            self.classified,
+        )
 
 
 class Builder:
@@ -231,11 +369,9 @@ class Builder:
 
         self.v_dyn = re.compile(r"ELF (64|32)\-bit LSB shared object,")
         self.v_bin = re.compile(r"ELF (64|32)\-bit LSB executable,")
-        self.shared_lib = re.compile(r".*Shared library: \[(.*)\].*")
-        self.r_path = re.compile(r".*Library rpath: \[(.*)\].*")
-        self.r_soname = re.compile(r".*Library soname: \[(.*)\].*")
         # Currently don't differentiate between internal and public
         self.soname_providers = None
+        self.file_types = FileTypes()
 
         # process args
         if not isinstance(specuri, pisi.uri.URI):
@@ -1160,11 +1296,7 @@ class Builder:
                 if not os.path.exists(fullpath):
                     # Dodgy symlinks
                     continue
-                filemagic = None
-                try:
-                    filemagic = magic.from_file(fullpath)
-                except:
-                    pass
+                filemagic = self.file_types.get(fullpath)
 
                 if filemagic is not None and self.is_dynamic_binary(
                     fullpath, filemagic
@@ -1387,42 +1519,81 @@ class Builder:
         self.files = files
 
     def file_actions(self):
+        """Strip the installed files, splitting their debug info, and drop
+        the special files which are not kept.
+
+        Files are stripped by a pool of strip_jobs workers, see eopkg.conf
+        and --strip-jobs. debug_map is filled in path order once they are
+        done, whatever order they finish in."""
+        global debug_map
         install_dir = self.pkg_install_dir()
 
+        # only these get something done by util.strip_file()
+        strippable = (
+            "current ar archive",
+            "SB executable",
+            "SB relocatable",
+            "SB shared object",
+        )
+        to_strip = []
         for root, dirs, files in os.walk(install_dir):
-            for fn in files:
+            dirs.sort()
+            for fn in sorted(files):
                 filepath = util.join_path(root, fn)
+                fileinfo = self.file_types.get(filepath)
+                if fileinfo is None:
+                    continue
                 try:
-                    fileinfo = magic.from_file(filepath)
-                    strip_debug_action(
-                        filepath, fileinfo, install_dir, self.actionGlobals
-                    )
-                    exclude_special_files(filepath, fileinfo, self.actionGlobals)
+                    if any(x in fileinfo for x in strippable):
+                        to_strip.append((filepath, fileinfo))
+                    else:
+                        exclude_special_files(filepath, fileinfo, self.actionGlobals)
                 except Exception:
                     pass
 
+        jobs = get_strip_jobs()
+        ctx.ui.debug("Stripping %d files with %d jobs" % (len(to_strip), jobs))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            debug_paths = executor.map(
+                lambda x: _get_debug_path(x[0], x[1], install_dir), to_strip
+            )
+
+            # copies and hard links of a file share its BuildID, hence its
+            # debug info file: they are stripped by the same worker
+            groups = {}
+            for (filepath, fileinfo), debug_path in zip(to_strip, debug_paths):
+                if debug_path is None:
+                    continue
+                key = debug_path[0] or filepath
+                groups.setdefault(key, []).append((filepath, fileinfo, debug_path))
+
+            futures = [
+                executor.submit(_strip_files, files, install_dir, self.actionGlobals)
+                for files in groups.values()
+            ]
+            entries = []
+            for future in futures:
+                entries.extend(future.result())
+
+        for entry in sorted(x for x in entries if x is not None):
+            debug_map[entry[0]] = entry[1]
+
+        # stripping changed them
+        self.file_types.classify([x[0] for x in to_strip], jobs)
+
     def get_soname(self, path):
         """Get the soname for a given path"""
-        code, out, err = pisi.util.run_batch(
-            "LC_ALL=C /usr/bin/readelf -d {}".format(path)
-        )
-
-        if code != 0:
+        info = pisi.elf.read(path)
+        if info is None:
             return None
-        for line in out.split(b"\n"):
-            line = line.strip()
-            g = self.r_soname.match(str(line))
-            if g:
-                return g.group(1)
-        return None
+        return info.soname
 
     def is_dynamic_library(self, path):
         """Similar to is_dynamic_binary, but only for libraries"""
         if not os.path.exists(path) or not os.path.isfile(path):
             return False
-        try:
-            mg = magic.from_file(path)
-        except Exception as e:
+        mg = self.file_types.get(path)
+        if mg is None:
             return False
         if self.v_dyn.match(mg):
             return True
@@ -1453,11 +1624,8 @@ class Builder:
 
     def accumulate_dependencies(self, path, emul32=False):
         """Accumulate all shared dependencies of a given path"""
-        code, out, err = pisi.util.run_batch(
-            "LC_ALL=C /usr/bin/readelf -d {}".format(path)
-        )
-
-        if code != 0:
+        info = pisi.elf.read(path)
+        if info is None:
             return []
 
         check_deps = set()
@@ -1470,19 +1638,13 @@ class Builder:
             # Currently on Solus this is the same thing as /usr/lib.
             valid_libs.update(["/usr/lib64", "/lib64"])
 
-        for line in out.decode().split("\n"):
-            line = line.strip()
-            g = self.shared_lib.match(line)
-            if g:
-                lib = g.group(1)
-                # Skip internally provided symbols
-                if lib in self.soname_providers:
-                    continue
-                check_deps.add(lib)
+        for lib in info.needed:
+            # Skip internally provided symbols
+            if lib in self.soname_providers:
                 continue
-            r = self.r_path.match(line)
-            if r:
-                r_paths.add(r.group(1))
+            check_deps.add(lib)
+        if info.rpath:
+            r_paths.update(info.rpath.split(":"))
 
         dirname = os.path.dirname(path)
 
@@ -1515,6 +1677,9 @@ class Builder:
 
         self.fetch_component()  # bug 856
 
+        # Every stage below looks at the types of the installed files
+        self.file_types.scan(self.pkg_install_dir(), get_strip_jobs())
+
         # Operations and filters for package files
         self.file_actions()
 
@@ -1690,6 +1855,7 @@ class Builder:
 
             pkg.close()
 
+        ctx.ui.debug("File types: %s" % self.file_types)
         self.set_state("buildpackages")
 
         if ctx.config.values.general.autoclean is True:
@@ -1,8 +1,12 @@
 # SPDX-FileCopyrightText: 2005-2011 TUBITAK/UEKAE, 2013-2017 Ikey Doherty, Solus Project
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+import collections
+import concurrent.futures
 from copy import deepcopy
 import os
+import stat
+import struct
 import pisi
 import pisi.context as ctx
 
@@ -76,40 +80,300 @@ def ignorance_is_bliss(f):
         return True
 
 
-def check_files(files, check_config=False):
-    results = deepcopy(_empty_results)
+# the stat baseline of a package, stored as files.stat next to its files.xml,
+# is a header and one entry per file in the order of files.xml. Files which
+# have not been written by the installation have an all zero entry.
+STAT_BASELINE_MAGIC = b"EOPKGSTB"
+STAT_BASELINE_VERSION = 1
+
+_baseline_header = struct.Struct("=8sII")
+_baseline_entry = struct.Struct("=QQQqq")
+
+
+def _signature(st):
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
 
+
+def record_baseline(pkg_dir, files, paths):
+    """Record the stat baseline of the files of a package just installed
+    to pkg_dir. Only files in paths, those written by the installation
+    and known to match files.xml, get an entry."""
+    data = bytearray(
+        _baseline_header.pack(STAT_BASELINE_MAGIC, STAT_BASELINE_VERSION, len(files))
+    )
+    empty = _baseline_entry.pack(0, 0, 0, 0, 0)
     for f in files:
-        if not check_config and f.type == "config":
-            continue
-        if not f.hash:
-            continue
-        if ignorance_is_bliss(f.path):
-            continue
+        entry = empty
+        if f.path in paths:
+            try:
+                st = os.lstat(os.path.join(ctx.config.dest_dir(), f.path))
+                entry = _baseline_entry.pack(*_signature(st))
+            except OSError:
+                pass
+        data += entry
+
+    with open(os.path.join(pkg_dir, ctx.const.files_stat), "wb") as f:
+        f.write(data)
+
+
+def read_baseline(pkg_dir, files):
+    """Return the stat baseline recorded in pkg_dir for files, the list of
+    its files.xml, as a dict of path -> signature. The dict is empty if
+    there is no usable baseline."""
+    try:
+        with open(os.path.join(pkg_dir, ctx.const.files_stat), "rb") as f:
+            data = f.read()
+    except OSError:
+        return {}
+
+    if len(data) < _baseline_header.size:
+        return {}
+    magic, version, count = _baseline_header.unpack_from(data)
+    if (
+        magic != STAT_BASELINE_MAGIC
+        or version != STAT_BASELINE_VERSION
+        or count != len(files)
+        or len(data) != _baseline_header.size + count * _baseline_entry.size
+    ):
+        return {}
+
+    baseline = {}
+    entries = _baseline_entry.iter_unpack(memoryview(data)[_baseline_header.size :])
+    for f, entry in zip(files, entries):
+        if entry[1]:
+            baseline[f.path] = entry
+    return baseline
+
 
-        is_file_corrupted = False
+def get_baseline(package):
+    """Return the stat baseline of the installed package"""
+    installdb = pisi.db.installdb.InstallDB()
+    files = installdb.get_files(package).list
+    return read_baseline(installdb.package_path(package), files)
 
-        path = os.path.join(ctx.config.dest_dir(), f.path)
+
+def is_unchanged(f, baseline, st=None):
+    """True if the stat signature of file f matches the baseline, its
+    content is then the one recorded in files.xml"""
+    signature = baseline.get(f.path)
+    if signature is None:
+        return False
+    if st is None:
         try:
-            is_file_corrupted = file_corrupted(f)
+            st = os.lstat(os.path.join(ctx.config.dest_dir(), f.path))
+        except OSError:
+            return False
+    return _signature(st) == signature
 
-        except pisi.util.FilePermissionDeniedError as e:
-            # Can't read file, probably because of permissions, skip
-            results["denied"].append(f.path)
 
-        except pisi.util.FileNotFoundError as e:
-            # Shipped file doesn't exist on the system
-            results["missing"].append(f.path)
+def classify_files(files, baseline):
+    """Split files into (unchanged, suspect) lists from stat alone, only
+    suspect files have to be hashed"""
+    unchanged = []
+    suspect = []
+    for f in files:
+        if is_unchanged(f, baseline):
+            unchanged.append(f)
+        else:
+            suspect.append(f)
+    return unchanged, suspect
+
+
+# number of files queued to the workers at once, files are read in inode
+# order within such a batch
+CHECK_BATCH_FILES = 4096
+
+
+def get_check_workers():
+    workers = ctx.config.values.general.check_workers
+    if workers == "auto":
+        return os.cpu_count() or 1
+    try:
+        workers = int(workers)
+    except ValueError:
+        workers = 1
+    return max(workers, 1)
+
+
+def _hash_file(path):
+    # runs in the workers, hashlib and reads release the GIL
+    try:
+        return pisi.util.sha1_file(path), None
+    except pisi.util.FilePermissionDeniedError:
+        return None, "denied"
+    except pisi.util.FileNotFoundError:
+        return None, "missing"
+
+
+class PackageCheck:
+    """Pending check of the files of a single package"""
+
+    def __init__(self, package, files, check_config, baseline=None):
+        self.package = package
+        self.files = files
+        self.check_config = check_config
+        self.baseline = baseline or {}
+        self.results = deepcopy(_empty_results)
+        self.futures = []  # (FileInfo, future) of files being hashed
 
+    def add(self, f, problem):
+        """Account file f with problem, which is None, missing, denied or
+        corrupted"""
+        if problem is None:
+            return
+        if problem == "corrupted":
+            problem = "config" if f.type == "config" else "corrupted"
+        self.results[problem].append(f.path)
+
+    def wants(self, f):
+        if not self.check_config and f.type == "config":
+            return False
+        if not f.hash:
+            return False
+        return not ignorance_is_bliss(f.path)
+
+
+def _unchanged_since(f, st, since):
+    """True if the regular file has the recorded size and has neither been
+    written nor had its inode changed since the given time"""
+    return (
+        since is not None
+        and stat.S_ISREG(st.st_mode)
+        and f.size is not None
+        and st.st_size == int(f.size)
+        and max(st.st_mtime, st.st_ctime) < since
+    )
+
+
+def _submit(executor, checks, since):
+    """Queue the files of checks which have to be hashed to executor, in
+    device and inode order"""
+    jobs = []
+    for check in checks:
+        for f in check.files:
+            if not check.wants(f):
+                continue
+
+            path = os.path.join(ctx.config.dest_dir(), f.path)
+            try:
+                st = os.lstat(path)
+            except FileNotFoundError:
+                check.add(f, "missing")
+                continue
+            except PermissionError:
+                check.add(f, "denied")
+                continue
+
+            if stat.S_ISLNK(st.st_mode):
+                target = pisi.util.read_link(path)
+                if pisi.util.sha1_data(target) != f.hash:
+                    check.add(f, "corrupted")
+            elif not (
+                _unchanged_since(f, st, since) or is_unchanged(f, check.baseline, st)
+            ):
+                jobs.append((st.st_dev, st.st_ino, path, f, check))
+
+    jobs.sort(key=lambda job: job[:2])
+    for dev, ino, path, f, check in jobs:
+        check.futures.append((f, executor.submit(_hash_file, path)))
+
+
+def _collect(check):
+    if not check.futures:
+        return check.results
+
+    for f, future in check.futures:
+        sha1, problem = future.result()
+        if problem is None and sha1 != f.hash:
+            problem = "corrupted"
+        check.add(f, problem)
+    check.futures = []
+
+    # hashed files have been accounted in inode order, report them in the
+    # order of files.xml
+    order = dict((f.path, i) for i, f in enumerate(check.files))
+    for paths in check.results.values():
+        paths.sort(key=order.get)
+    return check.results
+
+
+def _shutdown(executor, checks):
+    """Drop the files of checks not hashed yet and wait for the workers"""
+    # cancel_futures of shutdown needs Python 3.9
+    for check in checks:
+        for f, future in check.futures:
+            future.cancel()
+    executor.shutdown(wait=True)
+
+
+def _package_checks(packages, config, quick):
+    """Yield batches of PackageChecks holding about CHECK_BATCH_FILES files,
+    None stands for a package which is not installed"""
+    installdb = pisi.db.installdb.InstallDB()
+    batch = []
+    size = 0
+    for package in packages:
+        if not installdb.has_package(package):
+            batch.append((package, None))
+            continue
+
+        # Temporary hack until epoch
+        if package == "baselayout":
+            files = []
+        elif config:
+            files = installdb.get_config_files(package)
         else:
-            if is_file_corrupted:
-                # Detect file type
-                if f.type == "config":
-                    results["config"].append(f.path)
-                else:
-                    results["corrupted"].append(f.path)
-
-    return results
+            files = installdb.get_files(package).list
+
+        baseline = get_baseline(package) if quick else None
+        batch.append((package, PackageCheck(package, files, config, baseline)))
+        size += len(files)
+        if size >= CHECK_BATCH_FILES:
+            yield batch
+            batch = []
+            size = 0
+
+    if batch:
+        yield batch
+
+
+def check_packages(packages, config=False, since=None, quick=False):
+    """Check the files of packages with a pool of check_workers workers.
+
+    Yields (package, results) in the order of packages as soon as a package
+    has been checked, results being None if the package is not installed.
+    Files of the following packages are hashed in the meantime. With since,
+    a timestamp, regular files which have their recorded size and whose
+    mtime and ctime are older than since are not hashed. With quick, files
+    matching the stat baseline recorded at install time are not hashed."""
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=get_check_workers())
+    try:
+        pending = collections.deque()
+        for batch in _package_checks(packages, config, quick):
+            _submit(executor, [x for p, x in batch if x is not None], since)
+            pending.append(batch)
+            # keep the next batch queued while this one is reported
+            while len(pending) > 1:
+                for package, check in pending[0]:
+                    yield package, check and _collect(check)
+                pending.popleft()
+
+        while pending:
+            for package, check in pending[0]:
+                yield package, check and _collect(check)
+            pending.popleft()
+    finally:
+        _shutdown(executor, [x for batch in pending for p, x in batch if x])
+
+
+def check_files(files, check_config=False):
+    check = PackageCheck(None, files, check_config)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=get_check_workers())
+    try:
+        _submit(executor, [check], None)
+        return _collect(check)
+    finally:
+        _shutdown(executor, [check])
 
 
 def check_config_files(package):
@@ -1,6 +1,7 @@
 # SPDX-FileCopyrightText: 2005-2011 TUBITAK/UEKAE, 2013-2017 Ikey Doherty, Solus Project
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+import concurrent.futures
 import os
 
 from ordered_set import OrderedSet as set
@@ -12,6 +13,9 @@ import pisi.util as util
 import pisi.ui as ui
 import pisi.conflict
 import pisi.db
+import pisi.fetcher
+import pisi.uri
+import pisi.atomicoperations as atomicoperations
 
 
 def reorder_base_packages_old(order):
@@ -160,3 +164,112 @@ def calculate_download_sizes(order):
 
     ctx.ui.notify(ui.cached, total=total_size, cached=cached_size)
     return total_size, cached_size
+
+
+def get_download_workers():
+    bandwidth_limit = (
+        ctx.config.options.bandwidth_limit
+        or ctx.config.values.general.bandwidth_limit
+    )
+    if bandwidth_limit and bandwidth_limit != "0":
+        # the limit is applied per download, keep the total under it
+        return 1
+
+    try:
+        workers = int(ctx.config.values.general.download_workers)
+    except ValueError:
+        workers = 1
+    return max(workers, 1)
+
+
+def fetch_package(pkg_path, pkg_hash, show_progress=False):
+    """Fetch a package file into the package cache unless a valid copy is
+    already there, and verify its SHA1 sum. Returns the local path and
+    whether the package was cached. This is safe to run in the download
+    workers as it does not touch any database."""
+    uri = pisi.uri.URI(pkg_path)
+    if not uri.is_remote_file():
+        path = pkg_path
+        cached = True
+        sha1 = util.sha1_file(path)
+    else:
+        cached_packages_dir = ctx.config.cached_packages_dir()
+        path = util.join_path(cached_packages_dir, uri.filename())
+        # Bug 4113
+        cached = os.path.exists(path) and util.sha1_file(path) == pkg_hash
+        if cached:
+            return path, cached
+        if os.path.exists(path):
+            os.unlink(path)
+        fetcher = pisi.fetcher.Fetcher(uri, cached_packages_dir)
+        if show_progress:
+            fetcher.progress = ctx.ui.Progress
+        fetcher.fetch()
+        # hashed while downloading, no need to read the file again
+        sha1 = fetcher.sha1sum or util.sha1_file(path)
+
+    if sha1 != pkg_hash:
+        raise pisi.Error(
+            _("Download Error: Package does not match the repository package.")
+        )
+
+    return path, cached
+
+
+def __fetch_parallel(order):
+    located = [atomicoperations.Install.locate(x) for x in order]
+    workers = min(get_download_workers(), len(order)) or 1
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    futures = []
+    for pkg, pkg_path, pkg_hash in located:
+        ctx.ui.notify(ui.downloading, package=pkg, files=None)
+        futures.append(executor.submit(fetch_package, pkg_path, pkg_hash))
+
+    paths = []
+    try:
+        for (pkg, pkg_path, pkg_hash), future in zip(located, futures):
+            path, cached = future.result()
+            if cached:
+                ctx.ui.info(_("%s [cached]") % os.path.basename(path))
+            ctx.ui.notify(ui.downloaded, package=pkg, files=None)
+            paths.append(path)
+    finally:
+        # after a failure or on KeyboardInterrupt, do not start any more
+        # downloads, and do not wait for the running ones
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+    return paths
+
+
+def fetch_packages(order):
+    """Download the packages in order and return the paths of the package
+    files in the same order, so that they can be installed in the planned
+    order afterwards."""
+    if get_download_workers() > 1:
+        ctx.ui.info(
+            util.colorize(
+                _("Downloading %d package(s) using %d parallel downloads")
+                % (len(order), min(get_download_workers(), len(order))),
+                "yellow",
+            )
+        )
+        return __fetch_parallel(order)
+
+    paths = []
+    for index, (pkg, pkg_path, pkg_hash) in enumerate(
+        atomicoperations.Install.locate(x) for x in order
+    ):
+        ctx.ui.info(
+            util.colorize(_("Downloading %d / %d") % (index + 1, len(order)), "yellow")
+        )
+        ctx.ui.notify(ui.downloading, package=pkg, files=None)
+        path, cached = fetch_package(pkg_path, pkg_hash, True)
+        if cached:
+            ctx.ui.info(_("%s [cached]") % os.path.basename(path))
+        ctx.ui.notify(ui.downloaded, package=pkg, files=None)
+        paths.append(path)
+
+    return paths
@@ -3,6 +3,7 @@
 
 import os
 import sys
+import time
 import zipfile
 
 from ordered_set import OrderedSet as set
@@ -12,6 +13,8 @@ import pisi
 import pisi.context as ctx
 import pisi.util as util
 import pisi.atomicoperations as atomicoperations
+import pisi.dependency
+import pisi.relation
 import pisi.operations as operations
 import pisi.pgraph as pgraph
 import pisi.ui as ui
@@ -110,28 +113,22 @@ def install_pkg_names(A, reinstall=False):
         conflicts = operations.helper.check_conflicts(order, packagedb)
 
     automatic = operations.helper.extract_automatic(A, order)
-    paths = []
-    for x in order:
-        ctx.ui.info(
-            util.colorize(
-                _("Downloading %d / %d") % (order.index(x) + 1, len(order)), "yellow"
-            )
-        )
-        install_op = atomicoperations.Install.from_name(x)
-        paths.append(install_op.package_fname)
+
+    # nothing is removed or installed unless every package could be fetched
+    paths = operations.helper.fetch_packages(order)
 
     # fetch to be installed packages but do not install them.
     if ctx.get_option("fetch_only"):
         return
 
-    if conflicts:
-        operations.remove.remove_conflicting_packages(conflicts)
-
     try:
-        for path in paths:
+        if conflicts:
+            operations.remove.remove_conflicting_packages(conflicts)
+
+        for index, path in enumerate(paths):
             ctx.ui.info(
                 util.colorize(
-                    _("Installing %d / %d") % (paths.index(path) + 1, len(paths)),
+                    _("Installing %d / %d") % (index + 1, len(order)),
                     "yellow",
                 )
             )
@@ -325,6 +322,132 @@ def install_pkg_files(package_URIs, reinstall=False):
     return True
 
 
+class DependencyResolver:
+    """Checks the runtime dependencies of the packages of an install
+    closure, a level of the closure at a time.
+
+    The dependencies of all packages of a level are gathered first, the
+    installed and repository versions of the packages they name are then
+    loaded in one go, and every distinct dependency is checked only once."""
+
+    def __init__(self, packagedb, installdb):
+        self.packagedb = packagedb
+        self.installdb = installdb
+        self.installed_versions = {}  # name -> (version, release) or None
+        self.repo_versions = {}  # name -> (version, release) or None
+        self.installed = {}  # dependency key -> satisfied by installed
+        self.available = {}  # dependency key -> satisfied by repository
+        self.visited = 0
+        self.dependencies = 0
+        self.lookups = 0
+        self.start = time.perf_counter()
+
+    @staticmethod
+    def key(dep):
+        alternatives = getattr(dep, "dependencies", None)
+        if alternatives is not None:
+            # AnyDependency
+            return tuple(DependencyResolver.key(x) for x in alternatives)
+        return (dep.package,) + tuple(
+            getattr(dep, x) for x in pisi.dependency.DEPENDENCY_FIELDS
+        )
+
+    @staticmethod
+    def alternatives(dep):
+        alternatives = getattr(dep, "dependencies", None)
+        return [dep] if alternatives is None else alternatives
+
+    def __installed_version(self, name):
+        if self.installdb.has_package(name):
+            return self.installdb.get_version(name)[:2]
+
+    def __repo_version(self, name):
+        if self.packagedb.has_package(name):
+            pkg = self.packagedb.get_package(name)
+            return pkg.version, pkg.release
+
+    def __load(self, deps, versions, lookup):
+        """Load the versions of the packages deps name which are not known
+        yet into versions"""
+        for dep in deps:
+            for alternative in self.alternatives(dep):
+                if alternative.package not in versions:
+                    self.lookups += 1
+                    versions[alternative.package] = lookup(alternative.package)
+
+    def __satisfied(self, dep, versions, check):
+        # typed dependencies name pkgconfig files, not packages
+        for alternative in self.alternatives(dep):
+            if alternative.type:
+                self.lookups += 1
+                if check(alternative):
+                    return True
+                continue
+            version = versions[alternative.package]
+            if version is not None and alternative.satisfies_relation(*version):
+                return True
+        return False
+
+    def resolve(self, names):
+        """Return the (package, dependency, key) of the runtime dependencies
+        of the packages names, in order, all of them being checked"""
+        level = []
+        pending = {}
+        for name in names:
+            pkg = self.packagedb.get_package(name)
+            self.lookups += 1
+            for dep in pkg.runtimeDependencies():
+                key = self.key(dep)
+                if key not in self.available:
+                    pending.setdefault(key, dep)
+                level.append((pkg, dep, key))
+        self.visited += len(names)
+        self.dependencies += len(level)
+
+        # satisfied_by_installed() may have checked some of them already
+        unknown = [dep for key, dep in pending.items() if key not in self.installed]
+        self.__load(unknown, self.installed_versions, self.__installed_version)
+        for dep in unknown:
+            self.installed[self.key(dep)] = self.__satisfied(
+                dep,
+                self.installed_versions,
+                pisi.relation.installed_package_satisfies,
+            )
+
+        # only what is not installed yet is looked for in the repository
+        missing = [dep for key, dep in pending.items() if not self.installed[key]]
+        self.__load(missing, self.repo_versions, self.__repo_version)
+        for dep in missing:
+            self.available[self.key(dep)] = self.__satisfied(
+                dep, self.repo_versions, lambda x: x.satisfied_by_repo()
+            )
+        return level
+
+    def satisfied_by_installed(self, dep):
+        key = self.key(dep)
+        if key not in self.installed:
+            self.__load([dep], self.installed_versions, self.__installed_version)
+            self.installed[key] = self.__satisfied(
+                dep,
+                self.installed_versions,
+                pisi.relation.installed_package_satisfies,
+            )
+        return self.installed[key]
+
+    def __str__(self):
+        return (
+            "%d packages visited, %d dependencies checked (%d distinct), "
+            "%d database lookups in %.3fs"
+            % (
+                self.visited,
+                self.dependencies,
+                len(self.installed),
+                self.lookups,
+                time.perf_counter() - self.start,
+            )
+        )
+
+
 def plan_install_pkg_names(A):
     # try to construct a pisi graph of packages to
     # install / reinstall
@@ -333,49 +456,48 @@ def plan_install_pkg_names(A):
     installdb = pisi.db.installdb.InstallDB()
 
     # Check if updates are available to opt into the slow path
-    available_updates = list()
-    if len(pisi.api.list_upgradable()) != 0 and not ctx.get_option(
-        "ignore_revdeps_of_deps_check"
-    ):
-        available_updates = pisi.api.list_upgradable()
+    available_updates = set()
+    if not ctx.get_option("ignore_revdeps_of_deps_check"):
+        available_updates = set(pisi.api.list_upgradable())
+    debug = ctx.config.get_option("debug")
 
     G_f = pgraph.PGraph(packagedb)  # construct G_f
+    resolver = DependencyResolver(packagedb, installdb)
 
     # find the "install closure" graph of G_f by package
     # set A using packagedb
     for x in A:
         G_f.add_package(x)
     B = A
+    checked = set()
 
     while len(B) > 0:
         Bp = set()
-        checked = list()
-        for x in B:
-            pkg = packagedb.get_package(x)
-            for dep in pkg.runtimeDependencies():
+        for pkg, dep, key in resolver.resolve(B):
+            if debug:
                 ctx.ui.debug("checking %s" % str(dep))
-                # we don't deal with already *satisfied* dependencies
-                if not dep.satisfied_by_installed():
-                    if not dep.satisfied_by_repo():
-                        raise Exception(
-                            _("%s dependency of package %s is not satisfied")
-                            % (dep, pkg.name)
-                        )
-                    if not dep.package in G_f.vertices():
-                        Bp.add(str(dep.package))
-                    G_f.add_dep(x, dep)
-                # Check for updates in the revdeps of the deps of the pkg(s) we're installing to avoid breakage.
-                if dep.package in available_updates and not dep.package in checked:
-                    for name, revdep in packagedb.get_rev_deps(dep.package):
-                        if (
-                            installdb.has_package(name)
-                            and not revdep.satisfied_by_installed()
-                        ):
-                            checked.append(dep.package)
-                            if not name in G_f.vertices():
-                                Bp.add(name)
-                            G_f.add_dep(name, revdep)
+            # we don't deal with already *satisfied* dependencies
+            if not resolver.installed[key]:
+                if not resolver.available[key]:
+                    raise Exception(
+                        _("%s dependency of package %s is not satisfied")
+                        % (dep, pkg.name)
+                    )
+                if not dep.package in G_f.vertices():
+                    Bp.add(str(dep.package))
+                G_f.add_dep(pkg.name, dep)
+            # Check for updates in the revdeps of the deps of the pkg(s) we're installing to avoid breakage.
+            if dep.package in available_updates and not dep.package in checked:
+                checked.add(dep.package)
+                for name, revdep in packagedb.get_rev_deps(dep.package):
+                    if installdb.has_package(
+                        name
+                    ) and not resolver.satisfied_by_installed(revdep):
+                        if not name in G_f.vertices():
+                            Bp.add(name)
+                        G_f.add_dep(name, revdep)
         B = Bp
+    ctx.ui.debug("Install closure: %s" % resolver)
     if ctx.config.get_option("debug"):
         G_f.write_graphviz(sys.stdout)
     order = G_f.topological_sort()
@@ -1,6 +1,7 @@
 # SPDX-FileCopyrightText: 2005-2011 TUBITAK/UEKAE, 2013-2017 Ikey Doherty, Solus Project
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+import collections
 import sys
 
 from pisi import translate as _
@@ -165,24 +166,33 @@ def plan_remove(A):
     return G_f, order
 
 
-revdep_owner = None
-
-
-def revdep_from_hell(idb, orphans, order, pkgname):
+def find_orphan_owners(idb, orphans, removed=()):
     """
-    Evil in a box.
+    Map each installed package in orphans to the package that keeps it
+    installed, or to None if nothing does.
+
+    A package is kept if it can be reached through runtime dependencies from
+    an installed package which is neither in orphans nor in removed. Its
+    owner is such a package. All owners are found in a single breadth-first
+    pass over the installed dependency graph starting from those packages,
+    so each package and dependency edge is visited once.
     """
+    members = set(orphans).union(removed)
+    owners = {}
+    queue = collections.deque()
+    for pkg in idb.list_installed():
+        if pkg not in members:
+            owners[pkg] = pkg
+            queue.append(pkg)
 
-    global revdep_owner
+    while queue:
+        pkg = queue.popleft()
+        for dep in idb.get_dependencies(pkg):
+            if dep not in owners and idb.has_package(dep):
+                owners[dep] = owners[pkg]
+                queue.append(dep)
 
-    revdeps = idb.get_rev_deps(pkgname)
-    for name, rdep in revdeps:
-        if name not in orphans and name not in order:
-            revdep_owner = name
-            return False
-        if not revdep_from_hell(idb, orphans, order, name):
-            return False
-    return True
+    return dict((x, owners.get(x)) for x in orphans if idb.has_package(x))
 
 
 def plan_autoremove(name):
@@ -194,46 +204,23 @@ def plan_autoremove(name):
     that are still in use by other packages not in this list.
     """
     idb = pisi.db.installdb.InstallDB()
-    orphans = idb.list_auto_installed()
-    pg, pkgs = plan_remove(name)
-    order = pg.topological_sort()
-
-    murderficate = set()
-
-    # Build a first-leaf set of orphaned removals
-    for pkgID in pkgs:
-        pkg = idb.get_package(pkgID)
-        for runtimeDep in pkg.runtimeDependencies():
-            depName = runtimeDep.name()
-            if depName not in orphans:
-                continue
-            if not revdep_from_hell(idb, orphans, order, depName):
-                continue
-            murderficate.add(depName)
-
-    # Ensure our removal plan is consistent here
-    murderficate.update(set(order))
-    pg, pkgs = plan_remove(murderficate)
-
-    newSet = set(pkgs)
-
-    # Now for everyone we're removing, did that introduce through dependencies
-    # a now-orphaned package?
-    def depMangler(item):
-        pkg = idb.get_package(item)
-        for dep in pkg.runtimeDependencies():
-            nom = dep.name()
-            if nom in orphans and nom not in newSet:
-                if revdep_from_hell(idb, orphans, pkgs, nom):
-                    newSet.add(nom)
-                    depMangler(nom)
-
-    # Blast the whole pending list through the mangler
-    for item in pkgs:
-        depMangler(item)
+    orphans = set(idb.list_auto_installed())
+    pg, order = plan_remove(name)
+
+    removed = set(order)
+    owners = find_orphan_owners(idb, orphans, removed)
+
+    # Follow the dependencies of everything we are removing, and take the
+    # auto-installed packages nothing else needs along.
+    pending = list(removed)
+    while pending:
+        for dep in idb.get_dependencies(pending.pop()):
+            if dep in owners and owners[dep] is None and dep not in removed:
+                removed.add(dep)
+                pending.append(dep)
 
     # Return the consistently ordered graph
-    return plan_remove(newSet)
+    return plan_remove(removed)
 
 
 def plan_autoremove_all():
@@ -245,17 +232,8 @@ def plan_autoremove_all():
     set.
     """
     idb = pisi.db.installdb.InstallDB()
-    orphans = idb.list_auto_installed()
-
-    murderficate = set()
-    for pkgID in orphans:
-        if not idb.has_package(pkgID):
-            continue
-        if not revdep_from_hell(idb, orphans, murderficate, pkgID):
-            continue
-        murderficate.add(pkgID)
-
-    return plan_remove(murderficate)
+    owners = find_orphan_owners(idb, idb.list_auto_installed())
+    return plan_remove(set(x for x, owner in owners.items() if owner is None))
 
 
 def list_orphans():
@@ -263,18 +241,7 @@ def list_orphans():
     Helper function to return a list of potential orphans and parents
     """
     idb = pisi.db.installdb.InstallDB()
-    orphans = idb.list_auto_installed()
-    global revdep_owner
-
-    ret = dict()
-    for pkgID in orphans:
-        if not idb.has_package(pkgID):
-            continue
-        if not revdep_from_hell(idb, orphans, list(ret.keys()), pkgID):
-            ret[pkgID] = revdep_owner
-            continue
-        ret[pkgID] = None
-    return ret
+    return find_orphan_owners(idb, idb.list_auto_installed())
 
 
 def remove_conflicting_packages(conflicts):
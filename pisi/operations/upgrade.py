@@ -190,30 +190,24 @@ def upgrade(A=[], repo=None):
         conflicts = operations.helper.check_conflicts(order, packagedb)
 
     automatic = operations.helper.extract_automatic(A, order)
-    paths = []
-    for x in order:
-        ctx.ui.info(
-            util.colorize(
-                _("Downloading %d / %d") % (order.index(x) + 1, len(order)), "yellow"
-            )
-        )
-        install_op = atomicoperations.Install.from_name(x)
-        paths.append(install_op.package_fname)
+
+    # nothing is removed or installed unless every package could be fetched
+    paths = operations.helper.fetch_packages(order)
 
     # fetch to be upgraded packages but do not install them.
     if ctx.get_option("fetch_only"):
         return
 
-    if conflicts:
-        operations.remove.remove_conflicting_packages(conflicts)
+    try:
+        if conflicts:
+            operations.remove.remove_conflicting_packages(conflicts)
 
-    operations.remove.remove_obsoleted_packages()
+        operations.remove.remove_obsoleted_packages()
 
-    try:
-        for path in paths:
+        for index, path in enumerate(paths):
             ctx.ui.info(
                 util.colorize(
-                    _("Installing %d / %d") % (paths.index(path) + 1, len(paths)),
+                    _("Installing %d / %d") % (index + 1, len(order)),
                     "yellow",
                 )
             )
@@ -254,6 +248,7 @@ def plan_upgrade(A, force_replaced=True, replaces=None):
         G_f.add_package(x)
 
     installdb = pisi.db.installdb.InstallDB()
+    upgradable = pisi.db.upgradabledb.UpgradableDB()
 
     def add_runtime_deps(pkg, Bp):
         for dep in pkg.runtimeDependencies():
@@ -317,7 +312,7 @@ def plan_upgrade(A, force_replaced=True, replaces=None):
             if rev_dep in G_f.vertices() or depinfo.satisfied_by_repo():
                 continue
 
-            if is_upgradable(rev_dep):
+            if upgradable.is_upgradable(rev_dep):
                 Bp.add(rev_dep)
                 G_f.add_plain_dep(rev_dep, pkg.name)
 
@@ -331,7 +326,7 @@ def plan_upgrade(A, force_replaced=True, replaces=None):
         if packages:
             for target_package in packages:
                 for name, dep in installdb.get_rev_deps(target_package):
-                    if name in G_f.vertices() or not is_upgradable(name):
+                    if name in G_f.vertices() or not upgradable.is_upgradable(name):
                         continue
 
                     Bp.add(name)
@@ -383,8 +378,9 @@ def upgrade_base(A=set()):
             G_f, install_order = operations.install.plan_install_pkg_names(
                 extra_installs
             )
+            upgradable = pisi.db.upgradabledb.UpgradableDB()
             extra_upgrades = [
-                x for x in systembase - set(install_order) if is_upgradable(x)
+                x for x in systembase - set(install_order) if upgradable.is_upgradable(x)
             ]
             upgrade_order = []
 
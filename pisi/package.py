@@ -50,6 +50,8 @@ class Package:
         self.filepath = packagefn
         self.files = None
         self.repo = None
+        # paths written by extract_install
+        self.extracted_files = set()
 
         url = pisi.uri.URI(packagefn)
         if url.is_remote_file():
@@ -228,6 +230,8 @@ class Package:
                         ctx.ui.warning(e)
 
             else:
+                self.extracted_files.add(tarinfo.name)
+
                 # Added for package-manager
                 if tarinfo.name.endswith(".desktop"):
                     ctx.ui.notify(pisi.ui.desktopfile, desktopfile=tarinfo.name)
@@ -240,8 +244,9 @@ class Package:
             self.extract_dir_flat("install", outdir)
 
     def _files(self):
+        # without files.xml the archive finds its duplicates by itself
         if self.files is None:
-            return []
+            return None
 
         return [f.path for f in self.files.list]
 
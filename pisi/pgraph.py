@@ -5,7 +5,7 @@
 
 from . import graph
 
-# Cache the results from packagedb queries in a graph
+# Package versions are looked up in packagedb only when the graph is written
 
 
 class PGraph(graph.Digraph):
@@ -13,33 +13,33 @@ class PGraph(graph.Digraph):
         super(PGraph, self).__init__()
         self.packagedb = packagedb
 
+    def __check_package(self, pkg):
+        # fail on unknown packages the way fetching them does
+        if not self.packagedb.has_package(pkg):
+            self.packagedb.get_package(pkg)
+
     def add_package(self, pkg):
-        pkg1 = self.packagedb.get_package(pkg)
-        self.add_vertex(str(pkg), (pkg1.version, pkg1.release))
+        self.__check_package(pkg)
+        self.add_vertex(str(pkg))
 
     def add_plain_dep(self, pkg1name, pkg2name):
-        pkg1data = None
         if not pkg1name in self.vertices():
-            pkg1 = self.packagedb.get_package(pkg1name)
-            pkg1data = (pkg1.version, pkg1.release)
-        pkg2data = None
+            self.__check_package(pkg1name)
         if not pkg2name in self.vertices():
-            pkg2 = self.packagedb.get_package(pkg2name)
-            pkg2data = (pkg2.version, pkg2.release)
-        self.add_edge(str(pkg1name), str(pkg2name), ("d", None), pkg1data, pkg2data)
+            self.__check_package(pkg2name)
+        self.add_edge(str(pkg1name), str(pkg2name))
 
     def add_dep(self, pkg, depinfo):
-        pkg1data = None
         if not pkg in self.vertices():
-            pkg1 = self.packagedb.get_package(pkg)
-            pkg1data = (pkg1.version, pkg1.release)
-        pkg2data = None
+            self.__check_package(pkg)
         if not depinfo.package in self.vertices():
-            pkg2 = self.packagedb.get_package(depinfo.package)
-            pkg2data = (pkg2.version, pkg2.release)
-        self.add_edge(
-            str(pkg), str(depinfo.package), ("d", depinfo), pkg1data, pkg2data
-        )
+            self.__check_package(depinfo.package)
+        self.add_edge(str(pkg), str(depinfo.package))
+
+    def vertex_data(self, u):
+        # versions are only shown in the graphviz output, look them up then
+        pkg = self.packagedb.get_package(u)
+        return pkg.version, pkg.release
 
     def write_graphviz_vlabel(self, f, u):
         (v, r) = self.vertex_data(u)
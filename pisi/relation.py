@@ -20,6 +20,8 @@ class Relation(metaclass=autoxml.autoxml):
         if self.version and version != self.version:
             return False
         else:
+            # this also rejects malformed versions, parsed versions are
+            # cached, see pisi.version.make_version
             v = pisi.version.make_version(version)
 
             if self.versionFrom and v < pisi.version.make_version(self.versionFrom):
@@ -60,5 +62,5 @@ def installed_package_satisfies(relation):
     if not installdb.has_package(pkg_name):
         return False
     else:
-        pkg = installdb.get_package(pkg_name)
-        return relation.satisfies_relation(pkg.version, pkg.release)
+        version, release, build = installdb.get_version(pkg_name)
+        return relation.satisfies_relation(version, release)
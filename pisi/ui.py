@@ -18,7 +18,8 @@
     cached,
     desktopfile,
     systemconf,
-) = list(range(14))
+    downloaded,
+) = list(range(15))
 
 
 class UI(object):
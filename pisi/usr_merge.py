@@ -9,6 +9,9 @@ import pisi.util
 
 from pisi.files import FileInfo
 
+# top level directories which are symlinks into /usr on merged systems
+MERGED_DIRS = ("bin", "sbin", "lib", "lib32", "lib64")
+
 
 def _islink(path):
     return os.path.islink(pisi.util.join_path(ctx.config.dest_dir(), path))
@@ -23,7 +26,7 @@ def is_usr_merged(path):
     """
     components = path.split('/')
 
-    if components[0] not in ['bin', 'sbin', 'lib', 'lib32', 'lib64']:
+    if components[0] not in MERGED_DIRS:
         return False
 
     for i, _ in enumerate(components[:-1]):
@@ -42,13 +45,7 @@ def is_usr_merged_duplicate(files, path):
     :param path: Path to check.
     :return: Boolean indicating if the file is usr merged and a duplicate.
     """
-    if not is_usr_merged(path):
-        return False
-
-    if len(files) > 0 and isinstance(files[0], FileInfo):
-        files = [f.path for f in files]
-
-    return usr_merged_path(path) in files
+    return UsrMergeContext(files).is_duplicate(path)
 
 
 def usr_merged_path(path):
@@ -59,3 +56,68 @@ def usr_merged_path(path):
     :return: Boolean indicating if the usr merged file exists.
     """
     return os.path.join('usr', path)
+
+
+class UsrMergeContext:
+    """
+    Answers is_usr_merged_duplicate() for all the files of one operation.
+
+    The paths of the files are put in a set once, and the symlink status of
+    the directories leading to them is looked up once per directory.
+    Whoever creates or removes a symlink during the operation must call
+    forget() with its path.
+    """
+
+    def __init__(self, files):
+        self.paths = set(f.path if isinstance(f, FileInfo) else f for f in files)
+        self.links = {}
+
+    def is_link(self, path):
+        try:
+            return self.links[path]
+        except KeyError:
+            self.links[path] = link = _islink(path)
+            return link
+
+    def is_usr_merged(self, path):
+        """Same as is_usr_merged(), with cached symlink checks."""
+        components = path.split('/')
+
+        if components[0] not in MERGED_DIRS:
+            return False
+
+        for i in range(1, len(components)):
+            if self.is_link('/'.join(components[:i])):
+                return True
+
+        return False
+
+    def is_duplicate(self, path):
+        """Same as is_usr_merged_duplicate() for the files of the context."""
+        if path.split('/', 1)[0] not in MERGED_DIRS:
+            return False
+
+        # the set lookup is cheaper than any symlink check
+        if usr_merged_path(path) not in self.paths:
+            return False
+
+        return self.is_usr_merged(path)
+
+    def add(self, path):
+        """Add path to the files of the context."""
+        self.paths.add(path)
+
+    def may_become_duplicate(self, path):
+        """True if path is usr merged but its usr merged equivalent is not
+        among the files of the context (yet)."""
+        if path.split('/', 1)[0] not in MERGED_DIRS:
+            return False
+
+        if usr_merged_path(path) in self.paths:
+            return False
+
+        return self.is_usr_merged(path)
+
+    def forget(self, path):
+        """Drop the cached symlink status of path."""
+        self.links.pop(path.rstrip('/'), None)
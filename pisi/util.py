@@ -350,7 +350,8 @@ def check_file(_file, mode=os.F_OK):
 def ensure_dirs(path):
     """Make sure the given directory path exists."""
     if not os.path.exists(path):
-        os.makedirs(path)
+        # it may be created by another thread in the meantime
+        os.makedirs(path, exist_ok=True)
 
 
 def clean_dir(path):
@@ -857,32 +858,37 @@ def split_version(package_version):
     return version, release, build
 
 
+def __release_key(package_version):
+    version, release, build = split_version(package_version)
+    return version, int(release), int(build) if build else None
+
+
 def filter_latest_packages(package_paths):
     """For a given pisi package paths list where there may also be multiple versions
     of the same package, filters only the latest versioned ones"""
 
     import pisi.version
 
-    latest = {}
+    latest = {}  # name -> (path, version, release key or None)
     for path in package_paths:
         name, version = parse_package_name(
             os.path.basename(path[: -len(ctx.const.package_suffix)])
         )
 
+        key = None
         if name in latest:
-            l_version, l_release, l_build = split_version(latest[name][1])
-            r_version, r_release, r_build = split_version(version)
-
+            l_key = latest[name][2]
             try:
-                l_release = int(l_release)
-                r_release = int(r_release)
-
-                l_build = int(l_build) if l_build else None
-                r_build = int(r_build) if r_build else None
-
+                if l_key is None:
+                    l_key = __release_key(latest[name][1])
+                    latest[name] = latest[name][:2] + (l_key,)
+                key = __release_key(version)
             except ValueError:
                 continue
 
+            l_version, l_release, l_build = l_key
+            r_version, r_release, r_build = key
+
             if l_build and r_build:
                 if l_build > r_build:
                     continue
@@ -891,14 +897,13 @@ def filter_latest_packages(package_paths):
                 continue
 
             elif l_release == r_release:
-                l_version = pisi.version.make_version(l_version)
-                r_version = pisi.version.make_version(r_version)
-
-                if l_version > r_version:
+                if pisi.version.make_version(l_version) > pisi.version.make_version(
+                    r_version
+                ):
                     continue
 
         if version:
-            latest[name] = (path, version)
+            latest[name] = (path, version, key)
 
     return [x[0] for x in list(latest.values())]
 
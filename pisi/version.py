@@ -3,6 +3,8 @@
 
 """version structure"""
 
+import functools
+
 from pisi import translate as _
 
 import pisi
@@ -21,6 +23,10 @@ __keywords = (
 )
 
 
+# number of parsed version strings kept by make_version
+VERSION_CACHE_SIZE = 16384
+
+
 # For Python2 compatibility
 def cmp(a, b):
     return (a > b) - (a < b)
@@ -37,7 +43,16 @@ def __make_version_item(v):
         return int(v[:-1]), v[-1]
 
 
+def __make_version_items(ver):
+    return tuple(map(__make_version_item, ver.split(".")))
+
+
+@functools.lru_cache(maxsize=VERSION_CACHE_SIZE)
 def make_version(version):
+    """Return the comparison key of a version string.
+
+    Keys are immutable tuples which compare like the versions they stand
+    for. They are cached, parsing the same string again is a lookup."""
     ver, sep, suffix = version.partition("_")
     try:
         if sep:
@@ -46,14 +61,9 @@ def make_version(version):
                 for keyword, value in __keywords:
                     if suffix.startswith(keyword):
                         return (
-                            list(map(__make_version_item, ver.split("."))),
+                            __make_version_items(ver),
                             value,
-                            list(
-                                map(
-                                    __make_version_item,
-                                    suffix[len(keyword) :].split("."),
-                                )
-                            ),
+                            __make_version_items(suffix[len(keyword) :]),
                         )
                 else:
                     # Probably an invalid version string. Reset ver string
@@ -61,12 +71,12 @@ def make_version(version):
                     ver = ""
             else:
                 return (
-                    list(map(__make_version_item, ver.split("."))),
+                    __make_version_items(ver),
                     0,
-                    list(map(__make_version_item, suffix.split("."))),
+                    __make_version_items(suffix),
                 )
 
-        return list(map(__make_version_item, ver.split("."))), 0, [(0, None)]
+        return __make_version_items(ver), 0, ((0, None),)
 
     except ValueError:
         raise InvalidVersionError(_("Invalid version string: '%s'") % version)